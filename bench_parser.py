@@ -0,0 +1,137 @@
+#!  /usr/bin/env python
+# encoding: UTF-8
+import datetime
+import gc
+import json
+from messages import rmessages, synthetic
+import os, sys
+import platform
+import time as times
+from timeit import default_timer
+
+def percentile(vals, pct):
+  'The `pct` percentile of the sorted list `vals`, by the nearest rank.'
+  if not vals: return 0.0
+  return vals[min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))]
+
+def parser(mode):
+  'The function that parses one message, as `mode` (attempt, or parse) has it.'
+  if mode == 'parse':
+    def parse(txt, ad):
+      try:
+        return rmessages.ThouMessage.parse(txt, ad)
+      except rmessages.ThouMsgError, e:
+        return e
+    return parse
+  return rmessages.ThouMessage.attempt
+
+def resident():
+  'Resident memory of this process, in bytes.'
+  with open('/proc/self/statm') as fch:
+    return int(fch.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def throughput(msgs, ad, parse, reps):
+  'The best rate (messages per second) of `reps` passes over `msgs`.'
+  best  = 0.0
+  for _ in range(reps):
+    sttm  = default_timer()
+    for code, how, txt in msgs:
+      parse(txt, ad)
+    best  = max(best, len(msgs) / (default_timer() - sttm))
+  return best
+
+def latencies(msgs, ad, parse):
+  'Times every message on its own, returning the sorted latencies (in microseconds) by class, and the successes by class.'
+  lats  = {}
+  oks   = {}
+  for code, how, txt in msgs:
+    sttm  = default_timer()
+    got   = parse(txt, ad)
+    lats.setdefault(code, []).append((default_timer() - sttm) * 1e6)
+    oks[code] = oks.get(code, 0) + int(not got.errors)
+  for code in lats:
+    lats[code].sort()
+  return (lats, oks)
+
+def footprint(msgs, ad, parse):
+  '''Returns how many objects, and how many bytes, are held per message for as long as its result is.
+Python 2 has no allocation tracer; the objects are the ones that the collector tracks, net of those freed on the way.'''
+  gc.collect()
+  gc.disable()
+  try:
+    objs  = gc.get_count()[0]
+    mem   = resident()
+    held  = [parse(txt, ad) for code, how, txt in msgs]
+    objs  = gc.get_count()[0] - objs
+    mem   = resident() - mem
+  finally:
+    gc.enable()
+  del held
+  return (float(objs) / len(msgs), float(mem) / len(msgs))
+
+def benchmark(options):
+  cnt     = int(options.get('COUNT', 20000))
+  seed    = int(options.get('SEED', 1000))
+  invalid = float(options.get('INVALID', 0.5))
+  mode    = options.get('MODE', 'attempt')
+  crp     = synthetic.ThouCorpus(seed, invalid)
+  msgs    = crp.messages(cnt)
+  parse   = parser(mode)
+  throughput(msgs[:1000], crp.ad, parse, 1)
+  rate        = throughput(msgs, crp.ad, parse, int(options.get('REPEAT', 3)))
+  lats, oks   = latencies(msgs, crp.ad, parse)
+  objs, mem   = footprint(msgs, crp.ad, parse)
+  klasses     = {}
+  for code, got in lats.items():
+    klasses[code] = {
+      'count':    len(got),
+      'success':  oks[code],
+      'p50_us':   percentile(got, 50),
+      'p90_us':   percentile(got, 90),
+      'p99_us':   percentile(got, 99),
+      'max_us':   got[-1]
+    }
+  return {
+    'when':     datetime.datetime.now().isoformat(),
+    'python':   platform.python_version(),
+    'mode':     mode,
+    'count':    cnt,
+    'seed':     seed,
+    'invalid':  invalid,
+    'msgs_per_sec':         rate,
+    'success_ratio':        float(sum(oks.values())) / cnt,
+    'objects_per_message':  objs,
+    'bytes_per_message':    mem,
+    'classes':  klasses
+  }
+
+def report(got, old = None):
+  def versus(new, prv):
+    return (' (%+.1f%%)' % ((new / prv - 1.0) * 100.0,)) if prv else ''
+  old = old or {}
+  okl = old.get('classes', {})
+  print '%d messages (%s, %d%% spoilt, seed %d): %.0f msg/s%s, %.1f%% parsed' % (got['count'], got['mode'], got['invalid'] * 100, got['seed'],
+    got['msgs_per_sec'], versus(got['msgs_per_sec'], old.get('msgs_per_sec')), got['success_ratio'] * 100.0)
+  print 'Held per message: %.1f objects, %.0f bytes' % (got['objects_per_message'], got['bytes_per_message'])
+  print '%-6s %7s %8s %9s %9s %9s %9s' % ('Class', 'Count', 'Parsed', 'p50 µs', 'p90 µs', 'p99 µs', 'max µs')
+  for code in sorted(got['classes']):
+    kls = got['classes'][code]
+    print '%-6s %7d %8d %9.1f %9.1f %9.1f %9.1f%s' % (code, kls['count'], kls['success'], kls['p50_us'], kls['p90_us'], kls['p99_us'], kls['max_us'],
+      versus(kls['p50_us'], okl.get(code, {}).get('p50_us')))
+
+def imain(args):
+  '''Benchmarks the parser over a made-up corpus (see `synthetic.ThouCorpus`); no database is needed.
+Options come from the environment: COUNT, SEED, INVALID (the share of spoilt messages), MODE (attempt or parse), REPEAT, JSON (where to write the results) and COMPARE (earlier results to set them against).'''
+  options = os.environ
+  got     = benchmark(options)
+  old     = None
+  if options.get('COMPARE'):
+    with open(options['COMPARE']) as fch:
+      old = json.load(fch)
+  report(got, old)
+  if options.get('JSON'):
+    with open(options['JSON'], 'w') as fch:
+      json.dump(got, fch, indent = 2, sort_keys = True)
+  return 0
+
+sys.exit(imain(sys.argv))
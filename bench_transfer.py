@@ -0,0 +1,199 @@
+#!  /usr/bin/env python
+# encoding: UTF-8
+import benchdb
+import bulkwriter
+import csv
+from cStringIO import StringIO
+import datetime
+import itertools
+import json
+from messages import synthetic
+import multiprocessing
+import os, sys
+import platform
+from timeit import default_timer
+import transferer
+import workqueue
+
+STAGES  = ['fetch', 'parse', 'store', 'checkpoint', 'other']
+# The transfer options that are on or off, going by whether they are there at all.
+FLAGS   = ['STREAM', 'TYPED', 'FORCE', 'DELETE']
+OFF     = ['', '0', 'false', 'no', 'off']
+
+def corpus(cnt, seed, invalid):
+  'The rows of `messagelog_message` to transfer: `cnt` made-up messages (see `synthetic.ThouCorpus`), a minute apart.'
+  crp = synthetic.ThouCorpus(seed, invalid)
+  return [(ix + 1, ix % 97 + 1, ix % 89 + 1, crp.ad - datetime.timedelta(minutes = cnt - ix), txt)
+          for ix, (code, how, txt) in enumerate(crp.messages(cnt))]
+
+class MemoryBackend:
+  'Runs the transfer against a `benchdb.MemoryDB`, so that only the client is measured.'
+  name  = 'memory'
+
+  def __init__(self, options):
+    pass
+
+  def setup(self, reps):
+    self.db = benchdb.MemoryDB()
+    self.db.seed(reps)
+    return self.db.connect()
+
+  def treated(self, conn):
+    return len(self.db.oldids.get(transferer.TREATED[0], []))
+
+  def teardown(self, conn):
+    conn.close()
+
+class PostgresBackend:
+  '''Runs the transfer in a schema of its own, in the database that `DSN` points at; the schema is dropped afterwards, unless KEEP is set.'''
+  name  = 'postgres'
+
+  def __init__(self, options):
+    self.dsn  = options['DSN']
+    self.keep = options.get('KEEP')
+
+  def setup(self, reps):
+    import psycopg2
+    conn        = psycopg2.connect(self.dsn)
+    self.schema = 'bench_%d_%s' % (os.getpid(), datetime.datetime.now().strftime('%H%M%S%f'))
+    curz        = conn.cursor()
+    curz.execute('CREATE SCHEMA %s; SET search_path TO %s;' % (self.schema, self.schema))
+    curz.execute('CREATE TABLE messagelog_message (id INTEGER PRIMARY KEY, contact_id INTEGER, connection_id INTEGER, date TIMESTAMP WITHOUT TIME ZONE, text TEXT);')
+    buf = StringIO()
+    out = csv.writer(buf)
+    for rep in reps:
+      out.writerow(rep)
+    buf.seek(0)
+    curz.copy_expert('COPY messagelog_message (id, contact_id, connection_id, date, text) FROM STDIN WITH CSV', buf)
+    curz.close()
+    conn.commit()
+    return conn
+
+  def treated(self, conn):
+    curz  = conn.cursor()
+    curz.execute('SELECT COUNT(DISTINCT oldid) FROM %s' % (transferer.TREATED[0],))
+    ans   = curz.fetchone()[0]
+    curz.close()
+    return ans
+
+  def teardown(self, conn):
+    conn.rollback()
+    if not self.keep:
+      curz  = conn.cursor()
+      curz.execute('DROP SCHEMA %s CASCADE' % (self.schema,))
+      conn.commit()
+    conn.close()
+
+def instrument(tally, stages):
+  '''Times the parse (net of the rows fetched on the way, when they are streamed) and the flushes of the transfer, into `stages`.
+Returns what puts things back as they were.'''
+  chunks  = transferer.parse_chunks
+  flush   = bulkwriter.BulkWriter.flush
+  def parse_chunks(*args, **kwargs):
+    its = chunks(*args, **kwargs)
+    while True:
+      sttm  = default_timer()
+      fch   = tally.times.get('fetch', 0.0)
+      try:
+        got = next(its)
+      finally:
+        stages['parse'] = stages['parse'] + (default_timer() - sttm) - (tally.times.get('fetch', 0.0) - fch)
+      yield got
+  def timed_flush(self):
+    sttm  = default_timer()
+    try:
+      return flush(self)
+    finally:
+      stages['store'] = stages['store'] + (default_timer() - sttm)
+  transferer.parse_chunks     = parse_chunks
+  bulkwriter.BulkWriter.flush = timed_flush
+  def restore():
+    transferer.parse_chunks     = chunks
+    bulkwriter.BulkWriter.flush = flush
+  return restore
+
+def flagged(options):
+  '''Returns `options` with the `FLAGS` as the transfer takes them: left out when they are off ("0", say), and "1" when they are on.
+The transfer only asks whether a flag is there, so a "0" would have turned it on.'''
+  ans = dict(options)
+  for flg in FLAGS:
+    if flg not in ans: continue
+    if str(ans[flg]).strip().lower() in OFF:
+      del ans[flg]
+    else:
+      ans[flg]  = '1'
+  return ans
+
+def run(backend, reps, options):
+  'Transfers all of `reps` through the `backend`, with the transfer `options`, and returns the figures.'
+  conn    = backend.setup(reps)
+  tally   = benchdb.Tally()
+  pgc     = benchdb.Counted(conn, tally)
+  stages  = dict([(stg, 0.0) for stg in STAGES])
+  opts    = dict(flagged(options), QUIET = '1')
+  wrks    = int(opts.get('WORKERS', 0))
+  pool    = multiprocessing.Pool(wrks) if wrks > 1 else None
+  restore = instrument(tally, stages)
+  out     = sys.stdout
+  try:
+    wque        = workqueue.WorkQueue(pgc, opts.get('TYPE', None), transferer.TREATED[0], opts.get('RUN', None))
+    sys.stdout  = StringIO()
+    sttm        = default_timer()
+    while transferer.single_handle(transferer.TREATED, pgc, [], opts, pool, wque):
+      pass
+    wall        = default_timer() - sttm
+  finally:
+    sys.stdout  = out
+    restore()
+    if pool:
+      pool.close()
+      pool.join()
+  done  = backend.treated(conn)
+  backend.teardown(conn)
+  stages['fetch']       = tally.times.get('fetch', 0.0)
+  stages['checkpoint']  = tally.times.get('checkpoint', 0.0)
+  stages['other']       = max(0.0, wall - sum([stages[stg] for stg in STAGES if stg != 'other']))
+  return {
+    'backend':  backend.name,
+    'settings': dict([(k, options[k]) for k in ['NUMBER', 'CHUNK', 'BATCH', 'WORKERS', 'STREAM', 'ITERSIZE', 'PIPELINE', 'TYPED', 'CACHE'] if k in options]),
+    'messages': len(reps),
+    'treated':  done,
+    'seconds':  wall,
+    'rows_per_sec':       len(reps) / wall,
+    'round_trips':        tally.total(),
+    'trips_per_message':  float(tally.total()) / len(reps),
+    'trips':    tally.trips,
+    'commits':  tally.commits,
+    'stages':   stages
+  }
+
+def grid(spec):
+  '''The settings to try, from GRID: "BATCH=500,1000 WORKERS=0,4" tries all four pairs.'''
+  axes  = [(ax.split('=')[0], ax.split('=')[1].split(',')) for ax in spec.split()]
+  return [dict(zip([nom for nom, vals in axes], got)) for got in itertools.product(*[vals for nom, vals in axes])]
+
+def report(got):
+  print '%s, %s: %d messages (%d treated) in %.2fs: %.0f rows/s, %.2f round trips/message, %d commits' % (got['backend'],
+    ' '.join(['%s=%s' % kv for kv in sorted(got['settings'].items())]) or 'defaults', got['messages'], got['treated'], got['seconds'],
+    got['rows_per_sec'], got['trips_per_message'], got['commits'])
+  print '  ' + ', '.join(['%s %.2fs (%.0f%%)' % (stg, got['stages'][stg], 100.0 * got['stages'][stg] / got['seconds']) for stg in STAGES])
+  print '  round trips: ' + ', '.join(['%s %d' % kv for kv in sorted(got['trips'].items()) if kv[1]])
+
+def imain(args):
+  '''Benchmarks the whole transfer (fetch, parse, store) over made-up messages.
+Without DSN, it runs against an in-memory stand-in (see `benchdb.MemoryDB`), which measures the client alone; with DSN (a libpq connection string), it runs in a throw-away schema of that database.
+Options come from the environment: COUNT, SEED, INVALID (share of spoilt messages), DSN, KEEP, GRID (settings to compare) and JSON (where to write the results); the rest (NUMBER, CHUNK, BATCH, WORKERS, STREAM ...) go to the transfer as they would to `transferer.py`.'''
+  options = dict(os.environ)
+  reps    = corpus(int(options.get('COUNT', 10000)), int(options.get('SEED', 1000)), float(options.get('INVALID', 0.3)))
+  backend = PostgresBackend(options) if options.get('DSN') else MemoryBackend(options)
+  rsts    = []
+  for sets in grid(options.get('GRID', '')) or [{}]:
+    got = run(backend, reps, dict(options, **sets))
+    report(got)
+    rsts.append(got)
+  if options.get('JSON'):
+    with open(options['JSON'], 'w') as fch:
+      json.dump({'when': datetime.datetime.now().isoformat(), 'python': platform.python_version(), 'runs': rsts}, fch, indent = 2, sort_keys = True)
+  return 0
+
+sys.exit(imain(sys.argv))
@@ -0,0 +1,332 @@
+# encoding: UTF-8
+import csv
+import datetime
+import re
+from timeit import default_timer
+
+STATEMENTS  = re.compile(r';\s*\n')
+COLUMN      = re.compile(r'\s*(\w+)\s+(.+?)(\s+(NOT|DEFAULT|PRIMARY)\b.*)?$', re.S)
+MARKER      = re.compile(r'\x01(\d+)\x01')
+COMMAS      = re.compile(r',\s*(?![^()]*\))')
+
+class MemoryDB:
+  '''A stand-in for the database, in memory, that knows just the statements that the transfer (`workqueue`, leases and all, `bulkwriter`, and the `rmessages.ThouSchema`) makes.
+It is for benchmarking the Python side of the transfer without a server; every statement costs next to nothing, so the figures are for the client alone.
+Tables are dicts of their `columns` (name to type) and `rows` (a list of dicts); there are no transactions, so a rollback undoes nothing.'''
+  def __init__(self):
+    self.tables = {}
+    self.oldids = {}
+
+  def create(self, tbl, cols, exists = False):
+    if tbl in self.tables:
+      if exists: return
+      raise Exception('relation "%s" already exists' % (tbl,))
+    self.tables[tbl] = {'columns': {}, 'rows': [], 'serial': 0}
+    for col in cols:
+      if not col.strip().startswith('PRIMARY KEY'):
+        self.add(tbl, col)
+
+  def add(self, tbl, col, exists = False):
+    got = COLUMN.match(col)
+    if exists and got.group(1) in self.tables[tbl]['columns']: return
+    self.tables[tbl]['columns'][got.group(1)] = got.group(2).upper()
+
+  def insert(self, tbl, row):
+    tab = self.tables[tbl]
+    if 'indexcol' in tab['columns'] and row.get('indexcol') is None:
+      tab['serial']   = tab['serial'] + 1
+      row['indexcol'] = tab['serial']
+    tab['rows'].append(row)
+    if 'oldid' in row:
+      self.oldids.setdefault(tbl, set()).add(int(row['oldid']))
+    return row.get('indexcol')
+
+  def seed(self, msgs):
+    'Fills `messagelog_message` with the rows `msgs` (id, contact_id, connection_id, date, text); more can be seeded later, as if they had been committed late.'
+    self.create('messagelog_message', ['id SERIAL', 'contact_id INTEGER', 'connection_id INTEGER', 'date TIMESTAMP', 'text TEXT'], True)
+    for rep in msgs:
+      self.insert('messagelog_message', dict(zip(['id', 'contact_id', 'connection_id', 'date', 'text'], rep)))
+    self.tables['messagelog_message']['rows'].sort(key = lambda row: row['id'])
+
+  def topid(self):
+    return max([0] + [row['id'] for row in self.tables.get('messagelog_message', {'rows': []})['rows']])
+
+  def connect(self):
+    return MemoryConnection(self)
+
+class MemoryConnection:
+  def __init__(self, db):
+    self.db     = db
+    self.closed = False
+
+  def cursor(self, name = None, withhold = False):
+    return MemoryCursor(self.db, name)
+
+  def commit(self):
+    pass
+
+  def rollback(self):
+    pass
+
+  def close(self):
+    self.closed = True
+
+class MemoryCursor:
+  def __init__(self, db, name = None):
+    self.db       = db
+    self.name     = name
+    self.itersize = 2000
+    self.rows     = []
+    self.marked   = []
+    self.rowcount = -1
+
+  def mogrify(self, tpl, args):
+    'Not SQL at all: the values are kept aside, and the text only points at them.'
+    self.marked.append(tuple(args))
+    return '\x01%d\x01' % (len(self.marked) - 1,)
+
+  def execute(self, sql, args = ()):
+    self.rows     = []
+    self.rowcount = -1
+    for stt in STATEMENTS.split(sql.strip()):
+      if stt.strip():
+        self.statement(stt.strip().rstrip(';'), list(args or ()))
+
+  def statement(self, sql, args):
+    db  = self.db
+    got = re.match(r'CREATE TABLE (IF NOT EXISTS )?(\w+) \((.*)\)$', sql, re.S)
+    if got:
+      return db.create(got.group(2), COMMAS.split(got.group(3)), bool(got.group(1)))
+    if sql.startswith('CREATE INDEX'):
+      return
+    got = re.match(r'ALTER TABLE (\w+) ADD COLUMN (IF NOT EXISTS )?(.*)$', sql, re.S)
+    if got:
+      return db.add(got.group(1), got.group(3), bool(got.group(2)))
+    got = re.match(r'ALTER TABLE (\w+) ALTER COLUMN (\w+) DROP DEFAULT, ALTER COLUMN \w+ TYPE (\S+)', sql)
+    if got:
+      db.tables[got.group(1)]['columns'][got.group(2)] = got.group(3).upper()
+      return
+    if 'information_schema.columns' in sql:
+      self.rows = [(tbl, col, typ.split(' DEFAULT ')[0]) for tbl, tab in db.tables.items() for col, typ in tab['columns'].items()]
+      return
+    if 'FROM messagelog_message m' in sql:
+      return self.untreated(sql, args)
+    if 'RETURNING l.lo' in sql:
+      return self.claim(args)
+    got = re.match(r'INSERT INTO (\w+) \(run, lo, hi, lastid\) SELECT .* FROM generate_series\(', sql, re.S)
+    if got:
+      return self.carve(got.group(1), args)
+    got = re.match(r'UPDATE (\w+) SET (.*) WHERE run = %s AND lo = %s AND owner = %s$', sql, re.S)
+    if got:
+      return self.lease(got.group(1), got.group(2), args)
+    got = re.match(r'SELECT (.*) FROM (\w+) WHERE run = %s$', sql)
+    if got:
+      cols  = [col.strip() for col in got.group(1).split(',')]
+      self.rows = [tuple([row[col] for col in cols]) for row in db.tables[got.group(2)]['rows'] if row['run'] == args[0]]
+      return
+    got = re.match(r'SELECT COALESCE\(MAX\((\w+)\), 0\) FROM (\w+)$', sql)
+    if got:
+      self.rows = [(max([0] + list(db.oldids.get(got.group(2), []))),)]
+      return
+    got = re.match(r'SELECT NEXTVAL\(PG_GET_SERIAL_SEQUENCE\(%s, %s\)\) FROM GENERATE_SERIES\(1, %s\)$', sql)
+    if got:
+      tab       = db.tables[args[0]]
+      self.rows = [(ix,) for ix in range(tab['serial'] + 1, tab['serial'] + args[2] + 1)]
+      tab['serial'] = tab['serial'] + args[2]
+      return
+    got = re.match(r'INSERT INTO (\w+) \((.*?)\) VALUES (.*?)( RETURNING indexcol)?$', sql, re.S)
+    if got:
+      cols  = [col.strip() for col in got.group(2).split(',')]
+      vals  = [self.marked[int(ix)] for ix in MARKER.findall(got.group(3))] or [tuple(args)]
+      ids   = [db.insert(got.group(1), dict(zip(cols, val))) for val in vals]
+      if got.group(4):
+        self.rows = [(ix,) for ix in ids]
+      return
+    got = re.match(r'UPDATE (\w+) SET (.*) WHERE run = %s$', sql, re.S)
+    if got:
+      cols  = [asg.split('=')[0].strip() for asg in got.group(2).split(',') if '%s' in asg]
+      for row in db.tables[got.group(1)]['rows']:
+        if row['run'] == args[-1]:
+          row.update(dict(zip(cols, args)))
+          row['updated_at'] = datetime.datetime.now()
+      return
+    raise Exception('Not known to MemoryDB: %s' % (sql[:200],))
+
+  def untreated(self, sql, args):
+    'The query of `workqueue.WorkQueue`, done by hand.'
+    if 'LOWER(SUBSTR' in sql:
+      scope = args.pop(0)
+      keep  = lambda row: row['text'][:3].lower() == scope
+    else:
+      keep  = lambda row: True
+    lo    = args.pop(0)
+    hi    = args.pop(0) if len(args) > 1 else None
+    cpt   = args.pop(0)
+    done  = self.db.oldids.get(re.search(r'NOT EXISTS \(SELECT 1 FROM (\w+)', sql).group(1), set())
+    for row in self.db.tables['messagelog_message']['rows']:
+      if len(self.rows) >= cpt or (hi is not None and row['id'] > hi): break
+      if row['id'] > lo and row['id'] not in done and keep(row):
+        self.rows.append((row['id'], row['contact_id'], row['connection_id'], row['date'], row['text']))
+
+  def claim(self, args):
+    'The claim of `workqueue.LeaseQueue`, done by hand: the first free range of the run that is not done, and not in the list to skip.'
+    owner, secs, run, run, skip = args
+    now   = datetime.datetime.now()
+    for row in sorted(self.db.tables['transfer_leases']['rows'], key = lambda row: row['lo']):
+      if row['run'] != run or row['done'] or row['lo'] in skip: continue
+      if row['owner'] is not None and row['expires'] >= now: continue
+      row['owner'], row['expires']  = owner, now + datetime.timedelta(seconds = secs)
+      self.rows = [(row['lo'], row['hi'], row['lastid'], self.db.topid())]
+      return
+
+  def carve(self, tbl, args):
+    'The new ranges of `workqueue.LeaseQueue.carve`, done by hand.'
+    run, span, run, span  = args
+    rows  = self.db.tables[tbl]['rows']
+    lo    = max([0] + [row['hi'] for row in rows if row['run'] == run])
+    while lo <= self.db.topid() - 1:
+      rows.append({'run': run, 'lo': lo, 'hi': lo + span, 'lastid': lo, 'done': False, 'owner': None, 'expires': None})
+      lo  = lo + span
+
+  def lease(self, tbl, sets, args):
+    'The updates of a lease by its owner, done by hand: each of `sets` is a value, NULL, GREATEST of the column and a value, or NOW() plus some seconds.'
+    run, lo, owner  = args[-3:]
+    vals  = list(args[:-3])
+    rows  = [row for row in self.db.tables[tbl]['rows'] if row['run'] == run and row['lo'] == lo and row['owner'] == owner]
+    upd   = {}
+    for asg in COMMAS.split(sets):
+      col, val  = [part.strip() for part in asg.split('=', 1)]
+      if val == 'NULL':
+        upd[col]  = lambda row: None
+      elif val.startswith('GREATEST'):
+        upd[col]  = (lambda arg, col: lambda row: max(row[col], arg))(vals.pop(0), col)
+      elif val.startswith('NOW()'):
+        upd[col]  = (lambda arg: lambda row: datetime.datetime.now() + datetime.timedelta(seconds = arg))(vals.pop(0))
+      else:
+        upd[col]  = (lambda arg: lambda row: arg)(vals.pop(0))
+    for row in rows:
+      row.update(dict([(col, fun(row)) for col, fun in upd.items()]))
+    self.rowcount = len(rows)
+
+  def copy_expert(self, sql, buf):
+    got   = re.match(r'COPY (\w+) \((.*?)\) FROM STDIN', sql)
+    cols  = [col.strip() for col in got.group(2).split(',')]
+    for val in csv.reader(buf):
+      self.db.insert(got.group(1), dict(zip(cols, val)))
+
+  def fetchone(self):
+    return self.rows[0] if self.rows else None
+
+  def fetchall(self):
+    return self.rows
+
+  def __iter__(self):
+    return iter(self.rows)
+
+  def close(self):
+    pass
+
+def kind(sql):
+  'What part of the transfer a statement belongs to.'
+  if 'messagelog_message' in sql:
+    return 'fetch'
+  if 'information_schema' in sql or sql.lstrip().startswith(('CREATE', 'ALTER')):
+    return 'schema'
+  if 'transfer_checkpoints' in sql:
+    return 'checkpoint'
+  return 'store'
+
+class Tally:
+  'Round trips, commits and time spent in the database, by `kind`.'
+  def __init__(self):
+    self.trips    = {}
+    self.times    = {}
+    self.commits  = 0
+    self.rollbacks  = 0
+
+  def add(self, knd, sttm, trips = 1):
+    self.trips[knd] = self.trips.get(knd, 0) + trips
+    self.times[knd] = self.times.get(knd, 0.0) + (default_timer() - sttm)
+
+  def total(self):
+    return sum(self.trips.values()) + self.commits + self.rollbacks
+
+class Counted:
+  '''Wraps a connection (psycopg2's, or a `MemoryConnection`), keeping a `Tally` of what goes through it.'''
+  def __init__(self, conn, tally = None):
+    self.conn   = conn
+    self.tally  = tally or Tally()
+
+  def cursor(self, *args, **kwargs):
+    return CountedCursor(self.conn.cursor(*args, **kwargs), self.tally, bool(args or kwargs.get('name')))
+
+  def commit(self):
+    sttm  = default_timer()
+    self.conn.commit()
+    self.tally.commits  = self.tally.commits + 1
+    self.tally.add('commit', sttm, 0)
+
+  def rollback(self):
+    self.conn.rollback()
+    self.tally.rollbacks  = self.tally.rollbacks + 1
+
+  def close(self):
+    self.conn.close()
+
+  def __getattr__(self, nom):
+    return getattr(self.conn, nom)
+
+class CountedCursor:
+  def __init__(self, curz, tally, named):
+    self.curz   = curz
+    self.tally  = tally
+    self.named  = named
+    self.knd    = 'other'
+
+  def execute(self, sql, args = None):
+    self.knd  = kind(sql)
+    sttm      = default_timer()
+    ans       = self.curz.execute(sql, args)
+    # Named cursors only declare, here; the rows come with the fetches.
+    self.tally.add(self.knd, sttm, 0 if self.named else 1)
+    return ans
+
+  def copy_expert(self, sql, buf):
+    sttm  = default_timer()
+    ans   = self.curz.copy_expert(sql, buf)
+    self.tally.add(kind(sql), sttm)
+    return ans
+
+  def fetchone(self):
+    return self.curz.fetchone()
+
+  def fetchall(self):
+    return self.curz.fetchall()
+
+  def __iter__(self):
+    'Times the rows as they come, counting a round trip for every `itersize` of them on a named cursor.'
+    its   = iter(self.curz)
+    size  = self.curz.itersize if self.named else 0
+    cnt   = 0
+    while True:
+      sttm  = default_timer()
+      try:
+        rep = next(its)
+      except StopIteration:
+        self.tally.add(self.knd, sttm, 1 if self.named and not (cnt % size) else 0)
+        return
+      self.tally.add(self.knd, sttm, 1 if size and not (cnt % size) else 0)
+      cnt   = cnt + 1
+      yield rep
+
+  def close(self):
+    self.curz.close()
+
+  def __getattr__(self, nom):
+    return getattr(self.curz, nom)
+
+  def __setattr__(self, nom, val):
+    if nom in ('curz', 'tally', 'named', 'knd'):
+      self.__dict__[nom] = val
+    else:
+      setattr(self.curz, nom, val)
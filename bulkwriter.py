@@ -0,0 +1,137 @@
+# encoding: UTF-8
+import datetime
+from cStringIO import StringIO
+from messages import rmessages
+import stats
+from timeit import default_timer
+
+SQLTYPES  = [
+  (bool,              'BOOLEAN'),
+  (int,               'INTEGER'),
+  (long,              'BIGINT'),
+  (float,             'DOUBLE PRECISION'),
+  (datetime.datetime, 'TIMESTAMP WITHOUT TIME ZONE'),
+  (datetime.date,     'DATE')
+]
+
+def sqltype(val):
+  'Returns the SQL type of a column that is to hold values like `val`.'
+  for typ, nom in SQLTYPES:
+    if isinstance(val, typ):
+      return nom
+  return 'TEXT'
+
+def csvfield(val):
+  '''Returns `val` as a field of a line of COPY CSV.
+NULL (None) is a bare, empty field, and every other value is quoted, so that empty strings stay apart from NULLs. (The csv module quotes None too.)'''
+  if val is None:
+    return ''
+  if type(val) == type(u''):
+    val = val.encode('utf-8')
+  elif type(val) == type(0.0):
+    val = repr(val)
+  else:
+    val = str(val)
+  return '"%s"' % (val.replace('"', '""'),)
+
+class BulkWriter:
+  '''Gathers rows per table, and writes them a batch at a time, with a single commit per batch.
+Principal rows go in with one multi-row INSERT per table, which returns their `indexcol`s, so that their auxiliary rows can point at them. Every other row goes in with COPY.
+Tables and columns that are not yet there are created the first time they are met, as `orm.ORM.store` would, going by a `rmessages.ThouSchema`.'''
+  def __init__(self, conn, size = 1000, schema = None, types = None, sts = None):
+    '''`schema` is the `rmessages.ThouSchema` to go by; one is loaded at the first flush if it is not given.
+`types` gives the SQL types of columns (by table, then by column) that are to be created with a type of their own, rather than one that goes by their values.
+The rows and the time spent writing them (by table), and on commits, go in the `stats.Stats` `sts`.'''
+    self.conn   = conn
+    self.size   = size
+    self.schema = schema
+    self.types  = types or {}
+    self.stats  = sts or stats.Stats()
+    self.clear()
+
+  def clear(self):
+    self.princs = {}
+    self.rows   = {}
+    self.count  = 0
+
+  def principal(self, tbl, row, auxil):
+    '''Queues the principal `row` of table `tbl`, with its `auxil` values (a dict of auxiliary table to list of values).
+The auxiliary rows get their `principal` column once the principal row has been given its id.'''
+    self.princs.setdefault(tbl, []).append((row, auxil))
+    self.count  = self.count + 1
+
+  def store(self, tbl, row):
+    'Queues the `row` (a dict of column to value) of table `tbl`.'
+    self.rows.setdefault(tbl, []).append(row)
+    self.count  = self.count + 1
+
+  def full(self):
+    'Whether there are enough rows queued for a flush.'
+    return self.count >= self.size
+
+  def flush(self):
+    'Writes out all the queued rows, and commits.'
+    if not self.count: return
+    if self.schema is None:
+      self.schema = rmessages.ThouSchema(self.conn)
+    curz  = self.conn.cursor()
+    sts   = self.stats
+    try:
+      rows  = self.rows
+      for tbl, got in self.princs.items():
+        sttm  = default_timer()
+        ids   = self.insert(curz, tbl, [row for row, auxil in got])
+        sts.since('store_seconds', sttm, table = tbl)
+        sts.count('rows', len(got), table = tbl)
+        for ix, (row, auxil) in zip(ids, got):
+          for aux, vals in auxil.items():
+            rows.setdefault(aux, []).extend([{'principal': ix, 'value': val} for val in vals])
+      for tbl, got in rows.items():
+        sttm  = default_timer()
+        self.copy(curz, tbl, got)
+        sts.since('store_seconds', sttm, table = tbl)
+        sts.count('rows', len(got), table = tbl)
+      sttm  = default_timer()
+      self.conn.commit()
+      sts.since('commit_seconds', sttm)
+    except:
+      sts.count('rollbacks')
+      self.conn.rollback()
+      self.schema.reload()
+      raise
+    finally:
+      curz.close()
+    self.clear()
+
+  def columns(self, curz, tbl, rows):
+    'Makes sure that the table `tbl` has columns for `rows`, and returns the names of those columns.'
+    typs  = dict(self.types.get(tbl, {}))
+    for row in rows:
+      for k, v in row.iteritems():
+        if v is None or k in typs: continue
+        typs[k] = sqltype(v)
+    cols  = sorted(typs.keys())
+    ddl   = self.schema.missing(tbl, [(col, typs[col]) for col in cols])
+    if ddl:
+      curz.execute('\n'.join(ddl))
+    return cols
+
+  def insert(self, curz, tbl, rows):
+    '''INSERTs `rows` into `tbl` all at once, returning their ids in the same order.
+The ids are drawn from the sequence of `indexcol` first, and given to the rows; Postgres does not promise to hand RETURNING rows back in the order of the VALUES.'''
+    cols  = self.columns(curz, tbl, rows)
+    curz.execute('SELECT NEXTVAL(PG_GET_SERIAL_SEQUENCE(%s, %s)) FROM GENERATE_SERIES(1, %s)', (tbl, 'indexcol', len(rows)))
+    ids   = [got[0] for got in curz.fetchall()]
+    tpl   = '(%s)' % (', '.join(['%s'] * (len(cols) + 1)),)
+    vals  = ', '.join([curz.mogrify(tpl, [ix] + [row.get(col) for col in cols]) for ix, row in zip(ids, rows)])
+    curz.execute('INSERT INTO %s (%s) VALUES %s;' % (tbl, ', '.join(['indexcol'] + cols), vals))
+    return ids
+
+  def copy(self, curz, tbl, rows):
+    'COPYs `rows` into `tbl`.'
+    cols  = self.columns(curz, tbl, rows)
+    buf   = StringIO()
+    for row in rows:
+      buf.write(','.join([csvfield(row.get(col)) for col in cols]) + '\n')
+    buf.seek(0)
+    curz.copy_expert('COPY %s (%s) FROM STDIN WITH CSV' % (tbl, ', '.join(cols)), buf)
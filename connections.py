@@ -0,0 +1,95 @@
+# encoding: UTF-8
+from contextlib import contextmanager
+import os
+import psycopg2
+import threading
+
+# What the transfers connect to, unless DSN says otherwise.
+DATABASE  = {'dbname': 'thousanddays', 'user': 'thousanddays', 'password': 'thousanddays'}
+
+def settings(options):
+  'The arguments to `psycopg2.connect` that `options` ask for: DSN (a libpq connection string), or else the thousanddays database.'
+  if options.get('DSN'):
+    return {'dsn': options['DSN']}
+  return dict(DATABASE)
+
+class ConnectionPool:
+  '''Up to `size` connections, made by `connect` (with the `settings`) only as they are first needed, and handed to one user at a time, by `get` and `put` (or `connection`).
+A user that finds them all taken waits for one to be put back, so the threads of a pipeline can share a pool.
+A process that is forked off (a BACKGROUND run, or a worker) starts afresh with connections of its own. The ones it inherited belong to its parent, and are held on to untouched; closing them, or letting them be collected, would end the parent's sessions too.'''
+  def __init__(self, size = 1, connect = psycopg2.connect, **settings):
+    self.size       = size
+    self.connect    = connect
+    self.settings   = settings
+    self.inherited  = []
+    self.reset()
+
+  def reset(self):
+    self.pid  = os.getpid()
+    self.idle = []
+    self.busy = []
+    self.lock = threading.Condition()
+
+  def check(self):
+    if self.pid != os.getpid():
+      self.inherited.extend(self.idle + self.busy)
+      self.reset()
+
+  def get(self):
+    'A connection for the caller alone, until it is `put` back.'
+    self.check()
+    with self.lock:
+      while True:
+        while self.idle:
+          conn  = self.idle.pop()
+          if not conn.closed:
+            self.busy.append(conn)
+            return conn
+        if len(self.busy) < self.size: break
+        self.lock.wait()
+      conn  = self.connect(**self.settings)
+      self.busy.append(conn)
+      return conn
+
+  def put(self, conn):
+    'Takes back `conn`, to be handed out again (unless it was closed).'
+    if self.pid != os.getpid(): return
+    with self.lock:
+      if conn in self.busy:
+        self.busy.remove(conn)
+        if not conn.closed:
+          self.idle.append(conn)
+      self.lock.notify()
+
+  @contextmanager
+  def connection(self):
+    'A connection for the `with` block, rolled back if the block raises.'
+    conn  = self.get()
+    try:
+      yield conn
+    except:
+      if not conn.closed:
+        conn.rollback()
+      raise
+    finally:
+      self.put(conn)
+
+  def closeall(self):
+    'Closes the connections that this process made.'
+    self.check()
+    with self.lock:
+      for conn in self.idle + self.busy:
+        if not conn.closed:
+          conn.close()
+      self.idle = []
+      self.busy = []
+      self.lock.notify_all()
+
+POOL  = None
+
+def shared(options = os.environ):
+  '''The pool of this process, made the first time it is asked for, of POOL_SIZE connections (1 by default); every process has one of its own, of that size.'''
+  global POOL
+  if POOL is None:
+    POOL  = ConnectionPool(int(options.get('POOL_SIZE', 1)), **settings(options))
+  return POOL
@@ -1,11 +1,13 @@
 #!  /usr/bin/env python
 
-from ectomorph import orm
+import bulkwriter
+import connections
 from messages import rmessages
-import psycopg2
-import sys
+import itertools
+import os, sys
+import workqueue
 
-def store_components(mname, msg, fid):
+def store_components(wrtr, mname, msg, fid):
   princ = {}
   auxil = {}
   for k in msg.entries.keys():
@@ -17,42 +19,42 @@ def store_components(mname, msg, fid):
       auxil[subk] = naux
     else:
       princ[k]  = chose.data()
-  ix  = orm.ORM.store(mname, princ)
-  for k in auxil.keys():
-    val = auxil[k]
-    orm.ORM.store(k, {'principal': ix, 'value': val})
+  wrtr.principal(mname, princ, auxil)
 
-def store_failures(err, msg, fid):
+def store_failures(wrtr, err, msg, fid):
   pos = 0
   for fc in err.errors:
     fc  = fc[0] if type(fc) == type(('', None)) else fc
-    orm.ORM.store('failed_transfers', {'oldid': fid, 'message': msg, 'failcode': fc, 'failpos': pos})
+    wrtr.store('failed_transfers', {'oldid': fid, 'message': msg, 'failcode': fc, 'failpos': pos})
     pos = pos + 1
 
-def store_treatment(fid, stt):
-  orm.ORM.store('treated_messages', {'oldid': fid, 'success': stt})
+def store_treatment(wrtr, fid, stt):
+  wrtr.store('treated_messages', {'oldid': fid, 'success': stt})
 
 def imain(args):
-  conn  = psycopg2.connect(dbname = 'thousanddays', user = 'thousanddays', password = 'thousanddays')
-  curz  = conn.cursor()
-  curz.execute('''SELECT id, contact_id, connection_id, date, text FROM messagelog_message WHERE id NOT IN (SELECT oldid FROM treated_messages) ORDER BY RANDOM() LIMIT 10''')
-  orm.ORM.connect(dbname = 'thousanddays', user = 'thousanddays', password = 'thousanddays')
-  succ  = None
-  while True:
-    got   = curz.fetchone()
-    succ  = False
-    if not got:
-      break
-    try:
-      ans   = rmessages.ThouMessage.parse(got[4], got[3])
-      mname = str(ans.__class__).split('.')[-1].lower()
-      succ  = True
-      store_components(mname, ans, got[0])
+  conns = connections.shared(os.environ)
+  with conns.connection() as conn:
+    return handle(conn)
+
+def handle(conn):
+  wque  = workqueue.WorkQueue(conn)
+  wrtr  = bulkwriter.BulkWriter(conn)
+  reps  = wque.fetch(10)
+  rsts  = rmessages.ThouMessage.parse_many((got[4], got[3]) for got in reps)
+  for got, ans in itertools.izip(reps, rsts):
+    succ  = ans.success
+    if succ:
+      mname = str(ans.klass).split('.')[-1].lower()
+      store_components(wrtr, mname, ans.message, got[0])
       print "\033[34m\033[47m", ('Success with #%d %s:\n%s' % (got[0], got[4], str(ans.entries))), "\033[0m\n"
-    except rmessages.ThouMsgError, e:
-      store_failures(e, got[4], got[0])
-      print "\033[34m\033[47m", str([x.subname() for x in e.message.fields]), "\n\033[7m", ('Errors with #%d %s:\n%s' % (got[0], got[4], str(e.errors), )), "\033[0m\n"
-    store_treatment(got[0], succ)
+    else:
+      store_failures(wrtr, ans, got[4], got[0])
+      print "\033[34m\033[47m", str([x.subname() for x in ans.message.fields]), "\n\033[7m", ('Errors with #%d %s:\n%s' % (got[0], got[4], str(ans.errors), )), "\033[0m\n"
+    store_treatment(wrtr, got[0], succ)
+  if reps:
+    wque.checkpoint(reps[-1][0])
+  wrtr.flush()
+  conn.commit()
   return 0
 
 sys.exit(imain(sys.argv))
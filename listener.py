@@ -0,0 +1,70 @@
+# encoding: UTF-8
+import psycopg2
+import psycopg2.extensions
+import re
+import select
+from timeit import default_timer
+
+CHANNEL = 'messagelog_message'
+
+def install(conn, channel = CHANNEL):
+  '''Makes every statement that puts rows into `messagelog_message` NOTIFY `channel`, by a trigger; committed at once.
+It is one notification a statement, not a row, so a burst of messages (or a bulk load) wakes the listeners only the once.'''
+  if not re.match(r'^\w+$', channel):
+    raise Exception('Not a channel name: %s' % (channel,))
+  curz  = conn.cursor()
+  curz.execute('''CREATE OR REPLACE FUNCTION notify_%s() RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY %s;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS notify_%s ON messagelog_message;
+CREATE TRIGGER notify_%s AFTER INSERT ON messagelog_message FOR EACH STATEMENT EXECUTE PROCEDURE notify_%s();''' % (channel, channel, channel, channel, channel))
+  curz.close()
+  conn.commit()
+
+class Listener:
+  '''A connection of its own that LISTENs on `channel`: it is in autocommit, as LISTEN needs, and does nothing else, so it is not one of a pool.
+`wait` for a notification; the ones that came while the last were dealt with are taken in with the next.
+When the notifications that `wait` returned were first seen is `seen` (a `default_timer` reading, from before any linger).'''
+  def __init__(self, settings, channel = CHANNEL, connect = psycopg2.connect):
+    self.seen = None
+    self.conn = connect(**settings)
+    self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    curz      = self.conn.cursor()
+    curz.execute('LISTEN %s' % (channel,))
+    curz.close()
+
+  def take(self):
+    'How many notifications have come in, forgetting them.'
+    self.conn.poll()
+    got = len(self.conn.notifies)
+    del self.conn.notifies[:]
+    return got
+
+  def wait(self, timeout, linger = 0.0):
+    '''Waits up to `timeout` seconds for notifications, and returns how many came (none, if it timed out).
+With a `linger`, it goes on taking them in for that much longer, so that a burst is dealt with at once.'''
+    self.seen = default_timer()
+    got       = self.take()
+    if not got:
+      if select.select([self.conn], [], [], timeout) == ([], [], []):
+        return 0
+      self.seen = default_timer()
+      got       = self.take()
+    ends  = self.seen + linger
+    while linger and default_timer() < ends:
+      if select.select([self.conn], [], [], max(0.0, ends - default_timer())) != ([], [], []):
+        got = got + self.take()
+    return got
+
+  def ping(self):
+    'Makes sure that the connection is still there, raising (as psycopg2 does) if it is not; a dead peer is not always seen by `wait`.'
+    curz  = self.conn.cursor()
+    curz.execute('SELECT 1')
+    curz.close()
+
+  def close(self):
+    if not self.conn.closed:
+      self.conn.close()
@@ -0,0 +1,129 @@
+# encoding: utf-8
+# vim: expandtab ts=2
+
+import anydbm
+import cPickle as pickle
+from collections import OrderedDict
+from datetime import datetime, time
+import hashlib
+from parser import SPACES
+from rmessages import DateField, ThouMessage, ThouResult
+
+VERSION = '3'
+DATED   = {}
+
+def normalise(msg):
+  '''Returns `msg` with its whitespace trimmed and collapsed, which is all that the parser makes of it.
+(Only the text quoted in a `bad_text` error keeps the spacing that it was sent with.)'''
+  return ' '.join(SPACES.split(msg.strip()))
+
+def bucket(ad):
+  '''Returns the part of the date `ad` that parsing can depend on.
+That is its day, and whether it is past midnight: dates in messages have no time of day, and `LMPDateField.check_gap` holds when they are before `ad`.'''
+  return (ad.toordinal(), ad.time() > time())
+
+def dated(klass):
+  '''Whether what the message class `klass` makes of a message can depend on its date: whether one of its date fields is checked against it (see `DateField.check_gap`, which LMPDateField extends).
+The results of the other classes are the same whatever the date, so they are cached without it.'''
+  try:
+    return DATED[klass]
+  except KeyError:
+    DATED[klass] = ans = any([issubclass(step.field, DateField) and step.field.check_gap.__func__ is not DateField.check_gap.__func__ for step in klass.plan().steps])
+    return ans
+
+class ThouCache:
+  '''A bounded cache of `ThouResult`s, in front of `ThouMessage.attempt`, for the messages that are sent (or replayed) again and again.
+Results are kept by the normalised text of the message, and the `bucket` of its date if its class is `dated`; the least recently used are dropped once there are more than `size`.
+`hits` and `misses` count the lookups, for `stats`.'''
+  def __init__(self, size = 10000):
+    self.size     = size
+    self.entries  = OrderedDict()
+    self.hits     = 0
+    self.stored   = 0
+    self.misses   = 0
+
+  def attempt(self, msg, ad = None):
+    'Same as `ThouMessage.attempt`, parsing `msg` only if it has not been seen (for that date bucket, if it matters) already.'
+    ad  = ad or datetime.today()
+    txt = normalise(msg)
+    klass, code, rem  = ThouMessage.dispatch(txt)
+    key = (txt, bucket(ad) if dated(klass) else None)
+    try:
+      rst       = self.entries.pop(key)
+      self.hits = self.hits + 1
+    except KeyError:
+      rst = self.load(key)
+      if rst is None:
+        self.misses = self.misses + 1
+        rst         = klass.assess(klass, code, rem, ad)
+        self.save(key, rst)
+      else:
+        self.stored = self.stored + 1
+    self.entries[key] = rst
+    if len(self.entries) > self.size:
+      self.entries.popitem(False)
+    if rst.date != ad:
+      # Parsed for another date, which made no difference but to the date it is said to be for.
+      return ThouResult(rst.klass, rst.code, rst.text, ad, rst.values, rst.errors)
+    return rst
+
+  def parse(self, msg, ad = None):
+    'Same as `ThouMessage.parse`.'
+    return self.attempt(msg, ad).unwrap()
+
+  def parse_many(self, msgs):
+    'Same as `ThouMessage.parse_many`.'
+    today = datetime.today()
+    for msg, ad in msgs:
+      yield self.attempt(msg, ad or today)
+
+  def load(self, key):
+    'Returns the result kept elsewhere for `key`, if any; here, there is nowhere else.'
+    return None
+
+  def save(self, key, rst):
+    pass
+
+  def stats(self):
+    'Returns the size of the cache, and how many lookups were hits (in memory, or `stored` elsewhere) or misses, as a dict.'
+    tot = self.hits + self.stored + self.misses
+    return {
+      'size':     len(self.entries),
+      'capacity': self.size,
+      'hits':     self.hits,
+      'stored':   self.stored,
+      'misses':   self.misses,
+      'ratio':    (float(self.hits + self.stored) / tot) if tot else 0.0
+    }
+
+class ThouDiskCache(ThouCache):
+  '''A `ThouCache` that also keeps every result in the dbm file at `path`, so that a re-run does not parse again what an earlier run did.
+Results are filed under a hash of the text and the date bucket (if it has one), with the `version` of the parser; change it when the parser changes what it makes of messages.
+Only one process should have the file open at a time.'''
+  def __init__(self, path, size = 10000, version = VERSION):
+    ThouCache.__init__(self, size)
+    self.db       = anydbm.open(path, 'c')
+    self.version  = version
+
+  def digest(self, key):
+    txt, bkt  = key
+    if type(txt) == type(u''):
+      txt = txt.encode('utf-8')
+    return hashlib.sha1('%s\0%s\0%s' % (self.version, txt, '%d\0%d' % bkt if bkt else '-')).hexdigest()
+
+  def load(self, key):
+    try:
+      return pickle.loads(self.db[self.digest(key)])
+    except KeyError:
+      return None
+
+  def save(self, key, rst):
+    self.db[self.digest(key)] = pickle.dumps(rst, 2)
+
+  def sync(self):
+    'Writes out what the dbm module is holding back.'
+    if hasattr(self.db, 'sync'):
+      self.db.sync()
+
+  def close(self):
+    self.db.close()
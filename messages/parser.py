@@ -4,6 +4,37 @@
 from abc import ABCMeta, abstractmethod
 import re
 
+SPACES        = re.compile(r'\s+')
+FIELD_SUFFIX  = re.compile(r'field$')
+
+def tokenise(txt):
+  'Splits `txt` into its whitespace-separated tokens, all at once.'
+  txt = txt.strip()
+  return SPACES.split(txt) if txt else []
+
+def remainder(txt, pos):
+  'Returns the text of `txt` that is left once its first `pos` tokens have been consumed.'
+  txt = txt.strip()
+  if not pos: return txt
+  return (SPACES.split(txt, pos) + [''])[pos]
+
+CODES   = {}
+
+class ThouCodes:
+  '''The expectations of a field class, indexed for constant-time lookup.
+`folded` is the frozenset of case-folded codes, `ordinal` maps each case-folded code to its position in the expectations (the first one, should a code be repeated), `spelt` maps those positions back to the codes as spelt in the expectations, and `codes` lists the distinct codes in that spelling.'''
+  def __init__(self, exps):
+    self.ordinal  = {}
+    self.spelt    = {}
+    codes         = []
+    for ix, exp in enumerate(exps):
+      if exp.lower() in self.ordinal: continue
+      self.ordinal[exp.lower()] = ix
+      self.spelt[ix]  = exp
+      codes.append(exp)
+    self.folded   = frozenset(self.ordinal.keys())
+    self.codes    = tuple(codes)
+
 class ThouField:
   '''Class defining the field of a "RapidSMS 1000 Days" message field.
 Has the ability to parse itself from a message string, conditionally pulling several of itself before giving up.
@@ -16,40 +47,11 @@ It also supplies contextual information about its unsuccessful parsing.'''
   def pull(self, cod, txt, dt, many = False):
     '''A field will process thestring `txt` to parse of a valid object of its class (passed in as `self` and linked to the SMS code passed in as `cod`).
 Error cases are communicated as single-token error codes, strings that should be short, and unique for every error case.
-Returns a triple: the resulting Message object, the array of error codes, and the part of `txt` that has not been consumed to produce the Message object.'''
-    got = []
-    etc = txt
-    err = []
-    while True:
-      if not etc:
-        if not got:
-          err.append(('%s_missing_fields' % (cod,)).lower())
-        break
-      prv   = etc
-      stuff = re.split(r'\s+', etc, 1)
-      if len(stuff) < 2:
-        stuff.append('')
-      p1, etc = stuff
-      ans     = p1.strip()
-      etc     = etc.strip()
-      if self.expected(ans):
-        errs  = self.is_legal(ans, dt)
-        if errs:
-          if type(errs) == type([]):
-            err.extend(errs)
-          else:
-            err.append(errs)
-        else:
-          got.append(self.convert(ans))
-      else:
-        if many and got:
-          etc = prv
-        else:
-          err.append(('%s_invalid_code_field_%s' % (cod, self.subname())).lower())
-        break
-        # err.append("Invalid code (expected %s; not %s)" % (', '.join(self.expectations() or ['nothing']), ans))
-      if not many: break
-    return (self(got, many), err, etc)
+Returns a triple: the resulting Message object, the array of error codes, and the part of `txt` that has not been consumed to produce the Message object.
+Message classes do not come through here; they run a compiled `ThouPlan` instead.'''
+    cur       = ThouCursor(txt)
+    fob, err  = ThouStep(self, many).pull(cod.lower(), cur, dt)
+    return (fob, [e for e, at in err], cur.rest())
 
   @classmethod
   @abstractmethod
@@ -58,11 +60,19 @@ Returns a triple: the resulting Message object, the array of error codes, and th
 Default behaviour:
 If there are two expectations(), boolean.
 Otherwise, same value (string).'''
-    exps  = self.expectations()
-    if len(exps) == 2:
-      return exps[0].lower() == fld.lower()
+    cds = self.codes()
+    if len(cds.codes) == 2:
+      return cds.ordinal.get(fld.lower()) == 0
     return fld
 
+  @classmethod
+  def coerce(self, fld, dt):
+    '''Checks and converts `fld` in one go, returning a pair: the converted value, and the error codes (as `is_legal` would give them).
+This default one is no more than `is_legal` followed by `convert`. Fields that would otherwise do the same work twice (matching the same pattern, say) extend it.'''
+    errs  = self.is_legal(fld, dt)
+    if errs: return (None, errs)
+    return (self.convert(fld), [])
+
   @classmethod
   @abstractmethod
   def is_legal(self, fld, dt):
@@ -75,16 +85,22 @@ Otherwise, same value (string).'''
     'This method is to be extended to restrict fields to certain pre-determined codes.'
     return []
 
+  @classmethod
+  def codes(self):
+    'Returns the `ThouCodes` of this field class, built from its `expectations` on first use.'
+    try:
+      return CODES[self]
+    except KeyError:
+      CODES[self] = cds = ThouCodes(self.expectations())
+      return cds
+
   @classmethod
   def expected(self, fld):
     '''This method is to be extended if the `expectations` mechanism is almost sufficient, but requires some elaborate validation.
 This default one works best on the simple codes that we have, not every possible thing.'''
-    exps  = self.expectations()
-    if not exps: return True
-    for exp in exps:
-      if exp.lower() == fld.lower():
-        return True
-    return False
+    codes = self.codes().folded
+    if not codes: return True
+    return fld.lower() in codes
 
   @classmethod
   def fixed_for_db(self, val):
@@ -94,16 +110,55 @@ TODO: This only passes because we are using simple, plain codes in testing.'''
       return 'NULL'
     if type(val) in [type(x) for x in [1, 1.0]]:
       return str(val)
-    if val in self.expectations():
-      return self.fixed_for_db(self.expectations().index(val))
+    if isinstance(val, basestring):
+      ix  = self.codes().ordinal.get(val.lower())
+      if ix is not None:
+        return self.fixed_for_db(ix)
     if type(val) == type(''):
       return str("'%s'" % (val,)) # TODO: Proper SQL escapes, valid for current engine.
 
   @classmethod
   def dbtype(self, it = None):
     '''Field-level specificiation of the SQL data type to give to the database column that will hold the data held by this field.
-TODO: At present, every field is supposed to be a TEXT. This is clearly false in the case of dates, for instance.'''
-    return 'TEXT'    # TODO. Force them to adapt this per ThouField?
+By default, fields with two expectations are BOOLEAN (true for the first code, as `convert` has it), other fields with expectations hold the SMALLINT ordinal of their code (as `fixed_for_db` has it), and the rest are TEXT. Fields that convert to other things extend it.
+Either way, `column_code` reads the code back.'''
+    cds = self.codes()
+    if len(cds.codes) == 2:
+      return 'BOOLEAN'
+    if cds.codes:
+      return 'SMALLINT'
+    return 'TEXT'
+
+  @classmethod
+  def column_value(self, val):
+    'Returns the converted value `val` as it is to be stored in a column of `dbtype`.'
+    if isinstance(val, basestring) and self.dbtype() == 'SMALLINT':
+      return self.codes().ordinal.get(val.lower())
+    return val
+
+  @classmethod
+  def column_code(self, val):
+    'The other way round from `column_value`: returns the code that the value `val`, read from a column of `dbtype`, stands for. Values that are not codes are returned as they are.'
+    typ = self.dbtype()
+    if typ == 'BOOLEAN' and type(val) == type(True):
+      return self.codes().codes[0 if val else 1]
+    if typ == 'SMALLINT' and type(val) in (type(1), type(1L)):
+      return self.codes().spelt.get(val)
+    return val
+
+  @classmethod
+  def dbcast(self, col):
+    'Returns the SQL expression that turns the TEXT column `col` of old into a column of `dbtype`, when migrating a table in place.'
+    typ = self.dbtype()
+    if typ == 'TEXT':
+      return col
+    cds = self.codes()
+    # Codes go to what `column_value` makes of them, and ordinals (as `fixed_for_db` wrote them) to the codes they stand for.
+    if typ == 'BOOLEAN':
+      return "CASE UPPER(%s) WHEN '%s' THEN TRUE WHEN '%s' THEN FALSE WHEN '0' THEN TRUE WHEN '1' THEN FALSE ELSE NULLIF(%s, '')::BOOLEAN END" % (col, cds.codes[0].upper(), cds.codes[1].upper(), col)
+    if typ == 'SMALLINT':
+      return "CASE UPPER(%s) %s ELSE SUBSTRING(%s FROM '^[0-9]+$')::SMALLINT END" % (col, ' '.join(["WHEN '%s' THEN %d" % (cod.upper(), cds.ordinal[cod.lower()]) for cod in cds.codes]), col)
+    return "NULLIF(%s, '')::%s" % (col, typ)
 
   @classmethod
   def dbvalue(self, it, kasa):
@@ -121,12 +176,12 @@ TODO: Currently gives no heed to the opinions of the field itself.'''
   @classmethod
   def subname(self):
     'Returns the name of this field as it would be used in composing a column name.'
-    return self.column_name or str(self).split('.')[-1].lower()
+    return self.column_name or self.__name__.lower()
 
   @classmethod
   def display(self):
     'Returns the descriptive name of this field (useful for displaying database columns without listing the unsigtly column name).'
-    return re.sub(r'field$', '', str(self).split('.')[-1].lower())
+    return FIELD_SUFFIX.sub('', self.__name__.lower())
 
   def __init__(self, val, many):
     'Initialise the field and its associated value `val`, specifying whether it is one of `many` associated as a group with the message.'
@@ -145,3 +200,330 @@ TODO: Currently gives no heed to the opinions of the field itself.'''
 
   def __str__(self):
     return unicode(self)
+
+class ThouFault:
+  '''A conversion that failed, returned by a `coerce` that would rather not raise, in place of its error codes.
+It is taken just as an exception would have been: the field is given up, the cursor goes back to where it started, and the `text` (an error code of its own) is the error.
+`ThouMessage.parse` has always reported what the conversion raised with, though, so `conv` and `arg` are kept to work that out again (see `legacy`) on that path alone.'''
+  def __init__(self, text, conv = None, arg = None):
+    self.text = text
+    self.conv = conv
+    self.arg  = arg
+
+  def legacy(self):
+    'The error that `conv(arg)` raises with, as the exception path reported it; or `text`, if there is no such conversion.'
+    if self.conv is None:
+      return self.text
+    try:
+      self.conv(self.arg)
+    except Exception, e:
+      return str(e)
+    return self.text
+
+  def __str__(self):
+    return self.text
+
+class ThouCursor:
+  '''The tokens of a message, split only once, and the position of the next one to be consumed.
+Fields consume tokens through the cursor, so backing up is no more than resetting the position.
+Positions are reported from `base`, which is the position of the first token in the whole message.'''
+  def __init__(self, txt, base = 0):
+    self.text   = txt
+    self.tokens = tokenise(txt)
+    self.pos    = 0
+    self.base   = base
+
+  def done(self):
+    return self.pos >= len(self.tokens)
+
+  def take(self):
+    'Consumes and returns the next token.'
+    tok       = self.tokens[self.pos]
+    self.pos  = self.pos + 1
+    return tok
+
+  def mark(self):
+    return self.pos
+
+  def reset(self, mark):
+    'Backs up to a position previously returned by `mark`.'
+    self.pos  = mark
+
+  def position(self, mark = None):
+    'The position, in the whole message, of the next token (or of the one at `mark`).'
+    return self.base + (self.pos if mark is None else mark)
+
+  def rest(self):
+    'The text that has not been consumed.'
+    return remainder(self.text, self.pos)
+
+class ThouStep:
+  '''A single field of a compiled `ThouPlan`.
+Everything that used to be worked out again on every pull (the field's multiplicity, its case-folded expectations and its column name) is worked out once, here.'''
+  def __init__(self, fld, many = False, spec = None):
+    self.field    = fld
+    self.many     = many
+    self.spec     = spec or fld
+    self.invalid  = ('_invalid_code_field_%s' % (fld.subname(),)).lower()
+    self.codes    = fld.codes().folded or None
+    self.custom   = fld.expected.__func__ is not ThouField.expected.__func__
+    self.coerces  = fld.coerce.__func__ is not ThouField.coerce.__func__
+
+  def expected(self, ans):
+    'Same answer as the `expected` of the field, but off the frozen expectations unless the field has its own `expected`.'
+    if self.custom:
+      return self.field.expected(ans)
+    return self.codes is None or ans.lower() in self.codes
+
+  def pull(self, cod, cur, dt):
+    '''Pulls this field off the `ThouCursor` `cur`. The SMS code `cod` is expected in lower case.
+Returns a pair: the field object, and the array of (error code, token position) pairs.'''
+    got, err  = self.collect(cod, cur, dt)
+    if got is None:
+      raise ValueError(err.text)
+    return (self.field(got, self.many), err)
+
+  def collect(self, cod, cur, dt):
+    '''Same as `pull`, but returns the list of converted values instead of the field object.
+If `coerce` gives a `ThouFault`, that is all that is returned, with None for the values.'''
+    fld = self.field
+    got = []
+    err = []
+    while True:
+      if cur.done():
+        if not got:
+          err.append((cod + '_missing_fields', cur.position()))
+        break
+      mark  = cur.mark()
+      ans   = cur.take()
+      if self.expected(ans):
+        if self.coerces:
+          val, errs = fld.coerce(ans, dt)
+          if errs.__class__ is ThouFault:
+            return (None, errs)
+        else:
+          errs  = fld.is_legal(ans, dt)
+          val   = None if errs else fld.convert(ans)
+        if errs:
+          if type(errs) == type([]):
+            err.extend([(e, cur.position(mark)) for e in errs])
+          else:
+            err.append((errs, cur.position(mark)))
+        else:
+          got.append(val)
+      else:
+        if self.many and got:
+          cur.reset(mark)
+        else:
+          err.append((cod + self.invalid, cur.position(mark)))
+        break
+      if not self.many: break
+    return (got, err)
+
+  def shares(self, other):
+    'Whether a token that the step `other` would take could be taken by this one too.'
+    if self.custom or other.custom or self.codes is None or other.codes is None:
+      return True
+    return bool(self.codes & other.codes)
+
+  def value(self, got):
+    'The compact form of the values `got`: a tuple of them for many, or else the single one.'
+    if self.many:
+      return tuple(got)
+    return got[0]
+
+  def build(self, val):
+    'The field object of the compact value `val`, the same as `pull` would have made.'
+    if self.many:
+      return self.field(list(val), True)
+    return self.field([val], False)
+
+BACKTRACK = 64
+
+class ThouPlan:
+  '''The `fields` of a message class, compiled once into a flat list of `ThouStep`s.
+Running it tokenises the message a single time and hands the cursor from step to step, each field taking as many tokens as it can.
+That greedy run is all there is to it, unless a repeated field is followed by one that could take the same tokens (`contested`); then, if it fails, `search` looks for a better way to share the tokens out.
+Either way, the errors reported are those of the way that got furthest (see `furthest`).'''
+  def __init__(self, fields):
+    self.steps  = []
+    for fld in fields:
+      if type(fld) == type((1, 2)):
+        self.steps.append(ThouStep(fld[0], fld[1], fld))
+      else:
+        self.steps.append(ThouStep(fld))
+    self.contested  = frozenset([ix for ix, step in enumerate(self.steps[:-1]) if step.many and step.shares(self.steps[ix + 1])])
+
+  def run(self, cod, txt, dt):
+    '''Parses the text `txt` that follows the SMS code `cod` in a message.
+Returns a pair: the field objects, and the array of (error code, field, token position) triples.
+Token positions count the SMS code as token 0. Failed conversions are reported as they always have been (see `ThouFault.legacy`).'''
+    gots, errors  = self.collect(cod, txt, dt, True)
+    return ([step.field(got, step.many) for step, got in gots], errors)
+
+  def values(self, cod, txt, dt):
+    '''Same as `run`, but with the compact values of the fields (see `ThouStep.value`), one per step, in a tuple.
+The values are only worth anything when there are no errors; the tuple is empty otherwise.'''
+    gots, errors  = self.collect(cod, txt, dt)
+    if errors:
+      return ((), errors)
+    return (tuple([step.value(got) for step, got in gots]), errors)
+
+  def fields(self, vals):
+    'The field objects of the compact values `vals`, the same as `run` would have returned.'
+    return [step.build(val) for step, val in zip(self.steps, vals)]
+
+  def collect(self, cod, txt, dt, legacy = False):
+    cur           = ThouCursor(txt, 1)
+    cod           = cod.lower()
+    gots, errors  = self.walk(cod, cur, dt, 0, legacy)
+    if errors and self.contested:
+      return self.search(cod, cur, dt, legacy, (gots, errors))
+    return (gots, errors)
+
+  def walk(self, cod, cur, dt, frm, legacy):
+    'Runs the steps from the one at `frm` on, greedily, off the `ThouCursor` `cur`.'
+    gots    = []
+    errors  = []
+    for step in self.steps[frm:]:
+      mark  = cur.mark()
+      try:
+        got, err  = step.collect(cod, cur, dt)
+      except Exception, err:
+        got = None
+      if got is None:
+        cur.reset(mark)
+        if legacy and err.__class__ is ThouFault:
+          err = err.legacy()
+        errors.append((str(err), step.spec, cur.position()))
+        continue
+      errors.extend([(e, step.spec, at) for e, at in err])
+      gots.append((step, got))
+    if not cur.done():
+      errors.append(('bad_text', 'Superfluous text: "%s"' % (cur.rest(),), cur.position()))
+    return (gots, errors)
+
+  @staticmethod
+  def pull(step, cod, cur, dt, legacy):
+    '''Collects the values of `step` off `cur`, as `ThouStep.collect` does, but never raises.
+If the step is given up, returns None and the text of the error instead, as `run` (if `legacy`) or `values` reports it; the same as `walk` does, inline.'''
+    try:
+      got, err  = step.collect(cod, cur, dt)
+    except Exception, err:
+      return (None, str(err))
+    if got is None:
+      return (None, err.legacy() if legacy else str(err))
+    return (got, err)
+
+  def search(self, cod, cur, dt, legacy, greedy):
+    '''Looks for a way of sharing the tokens out that the `greedy` run missed: contested steps giving up the tokens at the end of their run, one at a time, to the steps after them.
+It is a recursive descent, memoised on the step and the token it starts from, so no state is worked out twice, and no more than `BACKTRACK` runs are given up in all.
+Returns the first way that has no errors; or else, of the ones tried, the one that got furthest (the greedy one, when it comes to a tie).'''
+    got = self.descend(cod, cur, dt, legacy, 0, 0, {}, [BACKTRACK])
+    if not got[1] or self.rank(got[1]) > self.rank(greedy[1]):
+      return got
+    return greedy
+
+  @staticmethod
+  def furthest(errors):
+    '''The token position of the first of `errors` (as `run` reports them), which is how far the message was matched before it went wrong; None if none of them has a position.'''
+    ats = [err[2] for err in errors if type(err) == type(()) and len(err) > 2]
+    return min(ats) if ats else None
+
+  @staticmethod
+  def rank(errors):
+    'How good a way with the `errors` is: the further its first error, and then the fewer its errors, the better.'
+    return (ThouPlan.furthest(errors), -len(errors))
+
+  def descend(self, cod, cur, dt, legacy, ix, pos, memo, budget):
+    key = (ix, pos)
+    if key in memo:
+      return memo[key]
+    cur.reset(pos)
+    if not [cix for cix in self.contested if cix >= ix]:
+      memo[key] = ans = self.walk(cod, cur, dt, ix, legacy)
+      return ans
+    step      = self.steps[ix]
+    got, err  = self.pull(step, cod, cur, dt, legacy)
+    if got is None:
+      sub = self.descend(cod, cur, dt, legacy, ix + 1, pos, memo, budget)
+      memo[key] = ans = (sub[0], [(err, step.spec, cur.base + pos)] + sub[1])
+      return ans
+    errs  = [(e, step.spec, at) for e, at in err]
+    tries = [(got, cur.mark())]
+    if ix in self.contested and not errs:
+      tries.extend([(got[:cnt], pos + cnt) for cnt in range(len(got) - 1, 0, -1)])
+    best  = None
+    for vals, nxt in tries:
+      if best is not None:
+        budget[0] = budget[0] - 1
+        if budget[0] < 0: break
+      sub = self.descend(cod, cur, dt, legacy, ix + 1, nxt, memo, budget)
+      ans = ([(step, vals)] + sub[0], errs + sub[1])
+      if not ans[1]:
+        best  = ans
+        break
+      if best is None or self.rank(ans[1]) > self.rank(best[1]):
+        best  = ans
+    memo[key] = best
+    return best
+
+class ThouTrie:
+  '''Keywords (the SMS codes, say) compiled into a trie, so that a word can be matched against all of them at once, exactly or within a few edits.
+Every node is a dict of letter to node, and the keyword that ends at a node is under None.'''
+  def __init__(self, words):
+    self.root   = {}
+    self.words  = frozenset(words)
+    for word in self.words:
+      node  = self.root
+      for ch in word:
+        node  = node.setdefault(ch, {})
+      node[None]  = word
+
+  def near(self, word, dist = 1):
+    '''Returns the keywords that are within `dist` edits of `word` (insertions, deletions, substitutions and transpositions of two letters side by side).
+Branches of the trie are given up as soon as they are more than `dist` edits away, so only a sliver of it is ever visited.'''
+    ans   = []
+    frst  = range(len(word) + 1)
+    for ch, node in self.root.iteritems():
+      self.search(node, ch, None, word, frst, None, dist, ans)
+    return ans
+
+  def search(self, node, ch, pch, word, prow, pprow, dist, ans):
+    row = [prow[0] + 1]
+    for ix in range(1, len(word) + 1):
+      got = min(row[ix - 1] + 1, prow[ix] + 1, prow[ix - 1] + (word[ix - 1] != ch))
+      if pprow and ix > 1 and word[ix - 1] == pch and word[ix - 2] == ch and ch != pch:
+        got = min(got, pprow[ix - 2] + 1)
+      row.append(got)
+    if row[-1] <= dist and None in node:
+      ans.append(node[None])
+    if min(row + prow) > dist: return
+    for nch, nxt in node.iteritems():
+      if nch is not None:
+        self.search(nxt, nch, ch, word, row, prow, dist, ans)
+
+  @staticmethod
+  def rank(word, kw):
+    '''How plausible a slip it is, to have typed `word` for the keyword `kw`: 0 for none at all, 1 for a keyword cut short (or run on), 2 for two letters swapped, and 3 for any other edit.'''
+    if kw == word:
+      return 0
+    if kw.startswith(word) or word.startswith(kw):
+      return 1
+    if len(kw) == len(word) and sorted(kw) == sorted(word):
+      return 2
+    return 3
+
+  def closest(self, word, dist = 1, least = 0):
+    '''Returns the keyword that `word` was most plausibly meant to be, or None if there is none within `dist` edits, or if two are as plausible as each other.
+Keywords shorter than `least` letters are only taken for a `word` with two of their letters swapped: one letter more, less or wrong makes another word of a short keyword too often.'''
+    if word in self.words:
+      return word
+    cands = [(self.rank(word, kw), kw) for kw in set(self.near(word, dist))]
+    cands = [(rnk, kw) for rnk, kw in cands if rnk == 2 or len(kw) >= least]
+    if not cands:
+      return None
+    cands.sort()
+    if len(cands) > 1 and cands[0][0] == cands[1][0]:
+      return None
+    return cands[0][1]
@@ -7,6 +7,33 @@ from datetime import datetime
 import re
 from parser import *
 
+PATTERNS  = {
+  'date':     re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})'),
+  'number':   re.compile(r'\d+'),
+  'whole':    re.compile(r'\s*[-+]?\d+\s*$', re.UNICODE),
+  'real':     re.compile(r'\s*[-+]?((\d+\.?\d*|\.\d+)(e[-+]?\d+)?|inf(inity)?|nan)\s*$', re.IGNORECASE | re.UNICODE),
+  'code':     re.compile(r'\w+'),
+  'floated':  re.compile(r'\w+\d+(\.\d+)?'),
+  'numbered': re.compile(r'\w+\d+'),
+  'visit':    re.compile(r'\w+\d'),
+  'muac':     re.compile(r'MUAC\d+(\.\d+)'),
+  'phone_id': re.compile(r'0\d{15}'),
+  'letters':  re.compile(r'[A-Z]', re.IGNORECASE),
+  'keyword':  re.compile(r'([A-Z]*)(\d.*)?$', re.IGNORECASE)
+}
+
+def whole(txt):
+  '''Returns a pair, as `ThouField.coerce` does: `int(txt)` and no errors, or else (where `int` would raise) no value and the `ThouFault` 'not_whole_number'.'''
+  if isinstance(txt, basestring) and not PATTERNS['whole'].match(txt):
+    return (None, ThouFault('not_whole_number', int, txt))
+  return (int(txt), [])
+
+def real(txt):
+  '''Same as `whole`, for `float(txt)`, with the `ThouFault` 'not_real_number'.'''
+  if isinstance(txt, basestring) and not PATTERNS['real'].match(txt):
+    return (None, ThouFault('not_real_number', float, txt))
+  return (float(txt), [])
+
 def first_cap(s):
   '''Capitalises the first letter (without assaulting the others like Ruby's #capitalize does).'''
   if len(s) < 1: return s
@@ -30,23 +57,37 @@ class DateField(ThouField):
     return True
 
   @classmethod
-  def is_legal(self, fld, dt):
-    ans = re.match(r'(\d{1,2})\.(\d{1,2})\.(\d{4})', fld)
-    if not ans: return 'bad_date'
+  def coerce(self, fld, dt):
+    'Matches the date only once, for both the checks and the conversion.'
+    ans = PATTERNS['date'].match(fld)
+    if not ans: return (None, 'bad_date')
     gps   = ans.groups()
     sdate = None
     try:
       sdate = datetime(year = int(gps[2]), month = int(gps[1]), day = int(gps[0]))
     except ValueError:
-      return 'impossible_date'
-    return ([] if self.check_gap(sdate, dt) else 'incoherent_date_periods')
+      return (None, 'impossible_date')
+    if not self.check_gap(sdate, dt): return (None, 'incoherent_date_periods')
+    return (sdate, [])
+
+  @classmethod
+  def is_legal(self, fld, dt):
+    return self.coerce(fld, dt)[1]
 
   @classmethod
   def convert(self, fld):
-    ans = re.match(r'(\d{1,2})\.(\d{1,2})\.(\d{4})', fld)
+    ans = PATTERNS['date'].match(fld)
     gps = ans.groups()
     return datetime(year = int(gps[2]), month = int(gps[1]), day = int(gps[0]))
 
+  @classmethod
+  def dbtype(self, it = None):
+    return 'DATE'
+
+  @classmethod
+  def column_value(self, val):
+    return val.date() if val else val
+
 class LMPDateField(DateField):
   'Date field, strictly for LMP.'
   # Mostly a disambiguation trick.
@@ -64,12 +105,22 @@ class NumberField(ThouField):
   @classmethod
   def is_legal(self, fld, dt):
     'Basically a regex.'
-    return [] if re.match(r'\d+', fld) else 'bad_number'
+    return [] if PATTERNS['number'].match(fld) else 'bad_number'
 
   @classmethod
   def convert(self, fld):
     return int(fld)
 
+  @classmethod
+  def coerce(self, fld, dt):
+    errs  = self.is_legal(fld, dt)
+    if errs: return (None, errs)
+    return whole(fld)
+
+  @classmethod
+  def dbtype(self, it = None):
+    return 'INTEGER'
+
 class CodeField(ThouField):
   'This should match basically any simple code, plain and numbered.'
 
@@ -77,7 +128,7 @@ class CodeField(ThouField):
   @classmethod
   def is_legal(self, fld, dt):
     'Basically a simple regex.'
-    return [] if re.match(r'\w+', fld) else 'what_code'
+    return [] if PATTERNS['code'].match(fld) else 'what_code'
 
 class GravidityField(NumberField):
   'Gravidity is a number.'
@@ -144,13 +195,23 @@ class FloatedField(CodeField):
   @classmethod
   def is_legal(self, fld, dt):
     'Basically a regex.'
-    return [] if re.match(r'\w+\d+(\.\d+)?', fld) else 'bad_floated_field'
+    return [] if PATTERNS['floated'].match(fld) else 'bad_floated_field'
 
   @classmethod
   def convert(self, fld):
-    ans = re.sub(r'[A-Z]', '', fld, 0, re.IGNORECASE)
+    ans = PATTERNS['letters'].sub('', fld)
     return float(ans)
 
+  @classmethod
+  def coerce(self, fld, dt):
+    errs  = self.is_legal(fld, dt)
+    if errs: return (None, errs)
+    return real(PATTERNS['letters'].sub('', fld))
+
+  @classmethod
+  def dbtype(self, it = None):
+    return 'REAL'
+
 class NumberedField(CodeField):
   'Field for codes that carry whole numbers.'
 
@@ -158,13 +219,23 @@ class NumberedField(CodeField):
   @classmethod
   def is_legal(self, fld, dt):
     'Basically a regex.'
-    return [] if re.match(r'\w+\d+', fld) else 'bad_numbered_field'
+    return [] if PATTERNS['numbered'].match(fld) else 'bad_numbered_field'
 
   @classmethod
   def convert(self, fld):
-    ans = re.sub(r'[A-Z]', '', fld, 0, re.IGNORECASE)
+    ans = PATTERNS['letters'].sub('', fld)
     return int(ans)
 
+  @classmethod
+  def coerce(self, fld, dt):
+    errs  = self.is_legal(fld, dt)
+    if errs: return (None, errs)
+    return whole(PATTERNS['letters'].sub('', fld))
+
+  @classmethod
+  def dbtype(self, it = None):
+    return 'INTEGER'
+
 class HeightField(NumberedField):
   'Field for height codes.'
 
@@ -200,7 +271,7 @@ class PhoneBasedIDField(IDField):
   @classmethod
   def is_legal(self, fld, dt):
     'Basic regex.'
-    return [] if re.match(r'0\d{15}', fld) else 'bad_phone_id'
+    return [] if PATTERNS['phone_id'].match(fld) else 'bad_phone_id'
 
 class ANCField(NumberedField):
   'Ante-Natal Care visit number is a ... number.'
@@ -209,7 +280,7 @@ class ANCField(NumberedField):
   @classmethod
   def is_legal(self, fld, dt):
     'Matches the code, not insisting on the string that precedes the number.'
-    return [] if re.match(r'\w+\d', fld) else 'anc_code'
+    return [] if PATTERNS['visit'].match(fld) else 'anc_code'
 
 class PNCField(NumberedField):
   'Post-Natal Care visit number is a ... number.'
@@ -218,7 +289,7 @@ class PNCField(NumberedField):
   @classmethod
   def is_legal(self, fld, dt):
     'Matches the code, not insisting on the string that precedes the number.'
-    return [] if re.match(r'\w+\d', fld) else 'pnc_code'
+    return [] if PATTERNS['visit'].match(fld) else 'pnc_code'
 
 class NBCField(NumberedField):
   'New-Born Care visit number is a ... number.'
@@ -227,7 +298,7 @@ class NBCField(NumberedField):
   @classmethod
   def is_legal(self, fld, dt):
     'Matches the code, not insisting on the string that precedes the number.'
-    return [] if re.match(r'\w+\d', fld) else 'nbc_code'
+    return [] if PATTERNS['visit'].match(fld) else 'nbc_code'
 
   @classmethod
   def expectations(self):
@@ -312,7 +383,7 @@ class MUACField(FloatedField):
   @classmethod
   def is_legal(self, fld, dt):
     'Regex alert.'
-    return [] if re.match(r'MUAC\d+(\.\d+)', fld) else 'bad_muac_code'
+    return [] if PATTERNS['muac'].match(fld) else 'bad_muac_code'
 
 class DeathField(CodeField):
   'Field for describing death codes.'
@@ -329,55 +400,255 @@ class ThouMsgError:
     self.errors     = errors
     self.message    = msg
 
+PLANS   = {}
+LAYOUTS = {}
+SCHEMAS = {}
+db      = None  # The connection that `ThouMessage.create_in_db` goes by, unless it is given a schema.
+
+class ThouLayout(object):
+  '''The columns of a message class, worked out only once.
+For its own table (as in `ThouMessage.creation_sql`): the `table` name, and the `columns` with their `types`, `defaults`, `specs` (type and default, for the DDL), `casts` (from TEXT, for migrations), `fields` and `labels`, with `index` giving the position of the (first) column of each field class.
+For the rows that the transfers write: the `name` of their table, the `principal` entries that are its columns, and the `auxiliary` pairs of the entries of repeated fields and the tables they go to; `entries` gives the field class of each entry, `positions` where it is in the compact values of a `ThouResult`, and `rowtypes` and `rowcasts` the types and casts of the columns of each of those tables.'''
+  __slots__ = ('table', 'columns', 'types', 'defaults', 'specs', 'casts', 'fields', 'labels', 'index',
+               'name', 'principal', 'auxiliary', 'entries', 'positions', 'rowtypes', 'rowcasts')
+
+  def __init__(self, klass, repc = None):
+    self.name       = (repc or klass).__name__.lower()
+    self.table      = self.name + 's'
+    self.columns    = []
+    self.types      = []
+    self.defaults   = []
+    self.specs      = []
+    self.casts      = []
+    self.fields     = []
+    self.labels     = []
+    self.index      = {}
+    self.principal  = []
+    self.auxiliary  = []
+    self.entries    = {}
+    self.positions  = {}
+    self.rowtypes   = {self.name: {}}
+    self.rowcasts   = {self.name: {}}
+    self.add('created_at', 'TIMESTAMP WITHOUT TIME ZONE', 'NOW()', None, 'No field class.', 'Created')
+    # self.add('modified_at', 'TIMESTAMP WITHOUT TIME ZONE', 'NOW()', None, 'No field class.', 'Modified')
+    for pos, step in enumerate(klass.plan().steps):
+      fld = step.field
+      col = fld.__name__.lower()
+      sub = fld.subname()
+      self.index.setdefault(fld, len(self.columns))
+      self.entries[sub] = fld
+      self.positions[sub] = pos
+      if step.many:
+        for exp in fld.codes().codes:
+          nom = '%s_%s' % (col, exp.lower())
+          self.add(nom, 'BOOLEAN', fld.default_dbvalue(), "NULLIF(%s, '')::BOOLEAN" % (nom,), fld, exp)
+        if sub not in [aux[0] for aux in self.auxiliary]:
+          aux = '%s_%s' % (self.name, sub)
+          self.auxiliary.append((sub, aux))
+          self.rowtypes[aux]  = {'value': fld.dbtype()}
+          self.rowcasts[aux]  = {'value': fld.dbcast('value')}
+      else:
+        self.add(col, fld.dbtype(), fld.default_dbvalue(), fld.dbcast(col), fld, first_cap(fld.display()))
+        if sub not in self.principal:
+          self.principal.append(sub)
+        self.rowtypes[self.name][sub] = fld.dbtype()
+        self.rowcasts[self.name][sub] = fld.dbcast(sub)
+
+  def add(self, col, typ, dft, cast, fld, lbl):
+    self.columns.append(col)
+    self.types.append(typ)
+    self.defaults.append(dft)
+    self.specs.append('%s DEFAULT %s' % (typ, dft))
+    self.casts.append(cast)
+    self.fields.append(fld)
+    self.labels.append(lbl)
+
+class ThouSchema:
+  '''The tables and columns (with their types) in the database, loaded with a single query and then kept up to date as they are added.
+Spares a round trip to `information_schema` for every table and column that has to be checked.'''
+  def __init__(self, conn):
+    self.conn   = conn
+    self.reload()
+
+  @staticmethod
+  def of(conn):
+    'Returns the `ThouSchema` of the connection `conn`, loading it on first use.'
+    try:
+      return SCHEMAS[conn]
+    except KeyError:
+      SCHEMAS[conn] = schema = ThouSchema(conn)
+      return schema
+
+  def reload(self):
+    self.tables = {}
+    curz  = self.conn.cursor()
+    curz.execute('SELECT table_name, column_name, UPPER(data_type) FROM information_schema.columns WHERE table_schema = ANY (CURRENT_SCHEMAS(FALSE))')
+    for tbl, col, typ in curz.fetchall():
+      self.tables.setdefault(tbl, {})[col] = typ
+    curz.close()
+
+  def missing(self, tbl, cols):
+    '''Returns the DDL that the table `tbl` needs, to have the columns `cols` (pairs of name and SQL type).
+From then on, they are taken to be there; `reload` if the DDL is not committed after all. The DDL holds good even if another process has just done the same.'''
+    ans   = []
+    have  = self.tables.get(tbl)
+    if have is None:
+      ans.append('CREATE TABLE IF NOT EXISTS %s (indexcol SERIAL NOT NULL);' % (tbl,))
+      have  = self.tables[tbl] = {'indexcol': 'INTEGER'}
+    for col, typ in cols:
+      if col not in have:
+        ans.append('ALTER TABLE %s ADD COLUMN IF NOT EXISTS %s %s;' % (tbl, col, typ))
+        have[col] = typ.split(' DEFAULT ')[0]
+    return ans
+
+  def retyped(self, tbl, cols):
+    '''Returns the DDL that converts, in place, the columns of `tbl` that are still TEXT but should not be.
+`cols` are triples of name, SQL type, and the SQL expression that converts the TEXT.'''
+    ans   = []
+    have  = self.tables.get(tbl, {})
+    for col, typ, cast in cols:
+      if have.get(col) == 'TEXT' and typ != 'TEXT':
+        ans.append('ALTER TABLE %s ALTER COLUMN %s DROP DEFAULT, ALTER COLUMN %s TYPE %s USING %s;' % (tbl, col, col, typ, cast))
+        have[col] = typ
+    return ans
+
+  def retype(self, klasses):
+    '''Converts the old TEXT columns of the message classes `klasses` to their proper types, in their own tables and in the tables the transfers write, all in one transaction.
+Returns the DDL that it ran.'''
+    ddl = []
+    for klass in klasses:
+      lay = klass.layout()
+      ddl.extend(self.retyped(lay.table, zip(lay.columns, lay.types, lay.casts)))
+      for tbl, typs in lay.rowtypes.items():
+        ddl.extend(self.retyped(tbl, [(col, typ, lay.rowcasts[tbl][col]) for col, typ in typs.items()]))
+    return self.run(ddl, 'Column conversion: ')
+
+  def migrate(self, klasses):
+    '''Brings the tables of the message classes `klasses` up to date, all in one transaction (and one round trip).
+Returns the DDL that it ran.'''
+    ddl = []
+    return self.update([klass.layout() for klass in klasses])
+
+  def update(self, lays):
+    'Same as `migrate`, for the `ThouLayout`s `lays`.'
+    ddl = []
+    for lay in lays:
+      ddl.extend(self.missing(lay.table, zip(lay.columns, lay.specs)))
+    return self.run(ddl, 'Table creation: ')
+
+  def run(self, ddl, what):
+    'Runs the DDL statements `ddl` in one transaction, and returns them. Failures are raised again, prefixed with `what`.'
+    if not ddl: return ddl
+    curz  = self.conn.cursor()
+    try:
+      curz.execute('\n'.join(ddl))
+      self.conn.commit()
+    except Exception, e:
+      self.conn.rollback()
+      self.reload()
+      raise Exception, (what + str(e))
+    finally:
+      curz.close()
+    return ddl
+
+class ThouResult(object):
+  '''What became of one message in `ThouMessage.parse_many`: whether it was a `success`, its message class (`klass`), its `entries` and its `errors`.
+Whole batches of these are held at a time, so all that is kept is the class, the SMS `code`, the `text` after it, the `date` it was parsed for, the `errors`, and the compact `values` of the fields (see `ThouPlan.values`; only for successes).
+The field objects of `entries`, and the `message` object (what `ThouMessage.parse` would have returned, or raised with), are made again every time they are asked for.'''
+  __slots__ = ('klass', 'code', 'text', 'date', 'values', 'errors')
+
+  def __init__(self, klass, cod, txt, dt, vals, errs):
+    self.klass  = klass
+    self.code   = cod
+    self.text   = txt
+    self.date   = dt
+    self.values = vals
+    self.errors = errs
+
+  @property
+  def success(self):
+    return not self.errors
+
+  @property
+  def reach(self):
+    'The token position of the first error, which is how far the message was matched before it went wrong (see `ThouPlan.furthest`); None for a success.'
+    return ThouPlan.furthest(self.errors) if self.errors else None
+
+  @property
+  def entries(self):
+    ans = {}
+    for fob in self.klass.plan().fields(self.values):
+      ans[fob.__class__.subname()] = fob
+    return ans
+
+  @property
+  def message(self):
+    if self.errors:
+      return self.klass.process(self.klass, self.code, self.text, self.date, False)
+    return self.klass(self.code, self.text, self.klass.plan().fields(self.values), [], self.date, False)
+
+  def value(self, sub):
+    'The value of the entry `sub`, as `data` of the field object would give it (but with a tuple for many).'
+    return self.values[self.klass.layout().positions[sub]]
+
+  def unwrap(self):
+    'Returns the message object, as `ThouMessage.parse` would have; or raises `ThouMsgError`, as it would have, if there are errors.'
+    msg = self.message
+    if self.errors:
+      raise ThouMsgError(msg, self.errors)
+    return msg
+
 class ThouMessage:
   '''Base class describing the standard RapidSMS 1000 Days message.'''
   fields      = []
-  created     = False
 
   # @staticmethod
   @classmethod
   def creation_sql(self, repc):
-    cols  = [('created_at', 'TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()', 'No field class.', 'Created'),
-             #  ('modified_at', 'TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()', 'No field class.', 'Modified')
-             ]
-    col   = None
-    for fld in self.fields:
-      if type(fld) == type((1, 2)):
-        fldc  = fld[0]
-        col   = str(fldc).split('.')[-1].lower()
-        for exp in fldc.expectations():
-          subans  = ('%s_%s' % (col, exp.lower()), '%s DEFAULT %s' % (fldc.dbtype(), fldc.default_dbvalue()), fldc, exp)
-          cols.append(subans)
-      else:
-        col = str(fld).split('.')[-1].lower()
-        cols.append((col, '%s DEFAULT %s' % (fld.dbtype(), fld.default_dbvalue()), fld, first_cap(fld.display())))
-    return (str(repc).split('.')[-1].lower() + 's', cols)
+    lay = self.layout_as(repc)
+    return (lay.table, zip(lay.columns, lay.specs, lay.fields, lay.labels))
 
   @classmethod
-  def create_in_db(self, repc):
+  def layout(self):
+    'Returns the `ThouLayout` of this message class, working it out on first use.'
     try:
-      tbl, cols = stuff = self.creation_sql(repc)
-      if self.created: return stuff
-      curz  = db.cursor()
-      curz.execute('SELECT TRUE FROM information_schema.tables WHERE table_name = %s', (tbl,))
-      if not curz.fetchone():
-        curz.execute('CREATE TABLE %s (indexcol SERIAL NOT NULL);' % (tbl,))
-        curz.close()
-        return self.create_in_db(repc)
-      for col in cols:
-        curz.execute('SELECT TRUE FROM information_schema.columns WHERE table_name = %s AND column_name = %s', (tbl, col[0]))
-        if not curz.fetchone():
-          curz.execute('ALTER TABLE %s ADD COLUMN %s %s;' % (tbl, col[0], col[1]))
-      curz.close()
-      db.commit()
-      self.created  = True
-      return stuff
-    except Exception, e:
-      raise Exception, ('Table creation: ' + str(e))
+      return LAYOUTS[self]
+    except KeyError:
+      LAYOUTS[self] = lay = ThouLayout(self)
+      return lay
+
+  @classmethod
+  def layout_as(self, repc):
+    'Returns the `ThouLayout` of the fields of this message class in the table of `repc`.'
+    return self.layout() if repc is self else ThouLayout(self, repc)
+
+  @classmethod
+  def create_in_db(self, repc, schema = None):
+    '''Creates the table of `repc` (or the columns it is missing), going by the `ThouSchema` `schema`.
+Without one, it goes by the schema of the module-wide connection `db`, loaded on first use.'''
+    lay = self.layout_as(repc)
+    (schema or ThouSchema.of(db)).update([lay])
+    return (lay.table, zip(lay.columns, lay.specs, lay.fields, lay.labels))
+
+  @staticmethod
+  def create_all_in_db(conn):
+    'Brings the tables of every message class up to date, in a single transaction on the connection `conn`. Returns the `ThouSchema`.'
+    schema  = ThouSchema(conn)
+    schema.migrate(MSG_ASSOC.values())
+    return schema
 
   @staticmethod
   def pull_code(msg):
-    return ((re.split(r'\s+', msg, 1)) + [''])[0:2]
+    return ((SPACES.split(msg, 1)) + [''])[0:2]
+
+  @classmethod
+  def plan(self):
+    'Returns the `ThouPlan` of this message class, compiling it on first use.'
+    try:
+      return PLANS[self]
+    except KeyError:
+      PLANS[self] = pln = ThouPlan(self.fields)
+      return pln
 
   @staticmethod
   def caseless_hash(hsh):
@@ -407,51 +678,90 @@ class ThouMessage:
     return erh(pz)
 
   @staticmethod
-  def parse(msg, ad = None):
+  def dispatch(msg):
+    '''Returns a triple: the message class that `msg` is addressed to, its SMS code, and the text that follows the code.
+Codes that are not known are put right by `recover`, if they can be.'''
     code, rem = ThouMessage.pull_code(msg.strip())
-    klass     = UnknownMessage
-    try:
-      klass     = MSG_ASSOC[code.upper()]
-    except KeyError:
-      pass
+    klass     = MSG_ASSOC.get(code.upper())
+    if klass:
+      return (klass, code, rem)
+    return ThouMessage.recover(code, rem)
+
+  @staticmethod
+  def recover(code, rem):
+    '''Same as `dispatch`, for the SMS `code` that is not known and the text `rem` that follows it.
+The commonest slips are put right, going by the `KEYWORDS` trie: the space after the code left out ("PRE1234..."), and the code mistyped by no more than `RECOVERY` edits ("RIS" or "RSIK" for "RISK"). Codes shorter than `FUZZY` letters are only recovered from two letters swapped ("PER" for "PRE"), since most other slips of them ("CHW", "DE") could as well be another code, or none. When two codes are as likely as each other, it is left alone, as an `UnknownMessage`.
+The code returned is then the one that was meant.'''
+    got = PATTERNS['keyword'].match(code)
+    kwd = got and KEYWORDS.closest(got.group(1).upper(), RECOVERY, FUZZY)
+    if not kwd:
+      return (UnknownMessage, code, rem)
+    if got.group(2):
+      rem = (got.group(2) + ' ' + rem).strip()
+    return (MSG_ASSOC[kwd], kwd, rem)
+
+  @staticmethod
+  def parse(msg, ad = None):
+    klass, code, rem  = ThouMessage.dispatch(msg)
     return klass.process(klass, code, rem, ad or datetime.today())
 
+  @staticmethod
+  def attempt(msg, ad = None):
+    '''Parses `msg` as `parse` does, but returns a `ThouResult` whether or not it fails; nothing is raised unless it is `unwrap`ped.
+Since failing messages are about as common as the others, they are kept off the exception path.'''
+    klass, code, rem  = ThouMessage.dispatch(msg)
+    return klass.assess(klass, code, rem, ad or datetime.today())
+
+  @staticmethod
+  def parse_many(msgs):
+    '''Parses every (text, date) pair of the iterable `msgs`, lazily and in order, yielding a `ThouResult` for each, as `attempt` does.
+It can sit in a stream of any length.'''
+    today = datetime.today()
+    for msg, ad in msgs:
+      klass, code, rem  = ThouMessage.dispatch(msg)
+      yield klass.assess(klass, code, rem, ad or today)
+
   # “Private”
   @staticmethod
-  def process(klass, cod, msg, dt):
-    errors  = []
-    fobs    = []
-    etc     = msg
-    for fld in klass.fields:
-      try:
-        if type(fld) == type((1, 2)):
-          cur, err, etc  = fld[0].pull(fld[0], cod, etc, dt, fld[1])
-          errors.extend([(e, fld) for e in err])
-        else:
-          cur, err, etc  = fld.pull(fld, cod, etc, dt)
-          errors.extend([(e, fld) for e in err])
-        fobs.append(cur)
-      except Exception, err:
-        errors.append((str(err), fld))
-    if etc.strip():
-      errors.append(('bad_text', 'Superfluous text: "%s"' % (etc.strip(),)))
-    return klass(cod, msg, fobs, errors, dt)
-
-  def __init__(self, cod, txt, fobs, errs, dt):
+  def process(klass, cod, msg, dt, strict = True):
+    fobs, errors  = klass.plan().run(cod, msg, dt)
+    return klass(cod, msg, fobs, errors, dt, strict)
+
+  @staticmethod
+  def assess(klass, cod, msg, dt):
+    'Same as `process` when not strict, but returns the compact `ThouResult`.'
+    pln         = klass.plan()
+    vals, errs  = pln.values(cod, msg, dt)
+    if not errs:
+      errs  = klass.semantics_check(vals, dt)
+      if errs: vals = ()
+    return ThouResult(klass, cod, msg, dt, vals, errs)
+
+  def __init__(self, cod, txt, fobs, errs, dt, strict = True):
+    '''Raises `ThouMsgError` if there are errors, unless it is not `strict`, in which case they are left in `errors` (and `entries` stays empty).'''
     self.code     = cod
     self.errors   = errs
     self.text     = txt
     self.fields   = fobs
-    if self.errors: raise ThouMsgError(self, self.errors)
-    semerrors     = self.semantics_check(dt)
-    if semerrors: raise ThouMsgError(self, semerrors)
+    self.entries  = {}
+    if self.errors:
+      if strict: raise ThouMsgError(self, self.errors)
+      return
+    semerrors     = self.semantics_check(tuple([step.value(fob.working_value) for step, fob in zip(self.plan().steps, fobs)]), dt)
+    if semerrors:
+      if strict: raise ThouMsgError(self, semerrors)
+      self.errors = semerrors
+      return
     def as_hash(p, n):
       p[n.__class__.subname()] = n
       return p
     self.entries  = reduce(as_hash, fobs, {})
 
+  @classmethod
   @abstractmethod
-  def semantics_check(self, adate):
+  def semantics_check(self, vals, adate):
+    '''Returns the errors in the compact values `vals` of the fields (one for each step of the `plan`; see `ThouPlan.values`), as of `adate`.
+A class method, so that `assess` runs it without making the message object.'''
     return ['Extend semantics_check.']  # Hey, why doesn’t 'abstract' scream out? TODO.
 
 class UnknownMessage(ThouMessage):
@@ -466,7 +776,8 @@ class PregMessage(ThouMessage):
               (SymptomCodeField, True),
              LocationField, WeightField, ToiletField, HandwashField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -474,7 +785,8 @@ class RefMessage(ThouMessage):
   'Referral message.'
   fields  = [PhoneBasedIDField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -484,7 +796,8 @@ class ANCMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, WeightField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -492,7 +805,8 @@ class DepMessage(ThouMessage):
   'Departure message.'
   fields  = [IDField, NumberField, DateField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -502,7 +816,8 @@ class RiskMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, WeightField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -510,7 +825,8 @@ class RedMessage(ThouMessage):
   'Red alert message.'
   fields  = [(RedSymptomCodeField, True), LocationField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -520,7 +836,8 @@ class BirMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, BreastFeedField, WeightField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -530,7 +847,8 @@ class ChildMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, WeightField, MUACField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -538,7 +856,8 @@ class DeathMessage(ThouMessage):
   'Death message.'
   fields  = [IDField, NumberField, DateField, LocationField, DeathField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -548,7 +867,8 @@ class ResultMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, InterventionField, MotherHealthStatusField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -558,7 +878,8 @@ class RedResultMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, InterventionField, MotherHealthStatusField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -568,7 +889,8 @@ class NBCMessage(ThouMessage):
              (SymptomCodeField, True),
              BreastFeedField, NBCInterventionField, NewbornHealthStatusField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -578,7 +900,8 @@ class PNCMessage(ThouMessage):
              (SymptomCodeField, True),
              InterventionField, MotherHealthStatusField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -588,7 +911,8 @@ class CCMMessage(ThouMessage):
              (SymptomCodeField, True),
              InterventionField, MUACField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -598,7 +922,8 @@ class CMRMessage(ThouMessage):
              (SymptomCodeField, True),
              InterventionField, NewbornHealthStatusField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -606,7 +931,8 @@ class CBNMessage(ThouMessage):
   'Commmunity-Based Nutrition message.'
   fields  = [IDField, NumberField, DateField, BreastFeedField, HeightField, WeightField, MUACField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -617,7 +943,8 @@ class ChildHealthMessage(ThouMessage):
              (SymptomCodeField, True),
              LocationField, WeightField, MUACField]
 
-  def semantics_check(self, adate):
+  @classmethod
+  def semantics_check(self, vals, adate):
     'TODO.'
     return []
 
@@ -640,3 +967,7 @@ MSG_ASSOC = {
   'CMR':  CMRMessage,
   'CBN':  CBNMessage
 }
+
+RECOVERY  = 1
+FUZZY     = 4
+KEYWORDS  = ThouTrie(MSG_ASSOC.keys())
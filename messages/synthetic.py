@@ -0,0 +1,117 @@
+# encoding: utf-8
+# vim: expandtab ts=2
+
+from datetime import datetime, timedelta
+import random
+from parser import ThouFault
+from rmessages import *
+
+def digits(rnd, cnt):
+  return ''.join([rnd.choice('0123456789') for _ in range(cnt)])
+
+def day(rnd, ad, lo, hi):
+  'A date (as in messages) between `lo` and `hi` days before `ad`.'
+  got = ad - timedelta(days = rnd.randint(lo, hi))
+  return '%d.%d.%d' % (got.day, got.month, got.year)
+
+# What open (code-less) fields are filled with, by field class, most specific first.
+SAMPLERS = [
+  (PhoneBasedIDField, lambda rnd, ad: '0' + digits(rnd, 15)),
+  (IDField,           lambda rnd, ad: rnd.choice('123456789') + digits(rnd, 15)),
+  (LMPDateField,      lambda rnd, ad: day(rnd, ad, 30, 250)),
+  (DateField,         lambda rnd, ad: day(rnd, ad, -30, 30)),
+  (NumberField,       lambda rnd, ad: str(rnd.randint(0, 9))),
+  (MUACField,         lambda rnd, ad: 'MUAC%d.%d' % (rnd.randint(8, 20), rnd.randint(0, 9))),
+  (FloatedField,      lambda rnd, ad: 'WT%d.%d' % (rnd.randint(2, 90), rnd.randint(0, 9))),
+  (ANCField,          lambda rnd, ad: 'ANC%d' % (rnd.randint(1, 4),)),
+  (PNCField,          lambda rnd, ad: 'PNC%d' % (rnd.randint(1, 5),)),
+  (NBCField,          lambda rnd, ad: 'NBC%d' % (rnd.randint(1, 5),)),
+  (HeightField,       lambda rnd, ad: 'HT%d' % (rnd.randint(40, 120),)),
+  (NumberedField,     lambda rnd, ad: 'N%d' % (rnd.randint(1, 9),)),
+  (ThouField,         lambda rnd, ad: 'X%d' % (rnd.randint(1, 9),))
+]
+
+JUNK  = ['??', 'XX', '3a', '32.13.2025', 'MUAC', 'WT', '0', 'HELLO', '12.5.20']
+
+# Ways of spoiling a message, as health workers do.
+SPOILERS  = ['missing', 'garbage', 'superfluous', 'swap', 'unknown', 'glued', 'typo']
+
+def legal(fld, tok, ad):
+  'Whether `fld` takes `tok` without any errors.'
+  try:
+    val, errs = fld.coerce(tok, ad)
+  except Exception:
+    return False
+  return not errs and errs.__class__ is not ThouFault
+
+class ThouCorpus:
+  '''Makes up messages for every class of `MSG_ASSOC`, going by the fields of each: codes are drawn from their expectations, other values from `SAMPLERS`, and only the ones that the field's validators take are used, where there are any.
+A share (`invalid`) of the messages is then spoilt by one of `SPOILERS`. The same `seed` makes the same messages.'''
+  def __init__(self, seed = 1000, invalid = 0.5, ad = None):
+    self.rnd      = random.Random(seed)
+    self.invalid  = invalid
+    self.ad       = ad or datetime(2026, 3, 1, 12, 0)
+    self.legals   = {}
+
+  def codes(self, fld):
+    'The codes of `fld` that its validators take (or all of them, if none are taken).'
+    try:
+      return self.legals[fld]
+    except KeyError:
+      cds = list(fld.codes().codes)
+      self.legals[fld] = got = [cd for cd in cds if legal(fld, cd, self.ad)] or cds
+      return got
+
+  def token(self, fld):
+    if fld.codes().codes:
+      return self.rnd.choice(self.codes(fld))
+    for klass, smp in SAMPLERS:
+      if issubclass(fld, klass): break
+    tok = smp(self.rnd, self.ad)
+    for _ in range(4):
+      if legal(fld, tok, self.ad): break
+      tok = smp(self.rnd, self.ad)
+    return tok
+
+  def tokens(self, klass):
+    ans = []
+    for step in klass.plan().steps:
+      if step.many:
+        cds = self.codes(step.field)
+        ans.extend(self.rnd.sample(cds, self.rnd.randint(1, min(3, len(cds)))))
+      else:
+        ans.append(self.token(step.field))
+    return ans
+
+  def spoil(self, code, toks):
+    how = self.rnd.choice(SPOILERS)
+    rnd = self.rnd
+    if how == 'missing' and toks:
+      del toks[rnd.randrange(len(toks))]
+    elif how == 'garbage' and toks:
+      toks[rnd.randrange(len(toks))] = rnd.choice(JUNK)
+    elif how == 'superfluous':
+      toks.append(rnd.choice(JUNK))
+    elif how == 'swap' and len(toks) > 1:
+      ix  = rnd.randrange(len(toks) - 1)
+      toks[ix], toks[ix + 1] = toks[ix + 1], toks[ix]
+    elif how == 'unknown':
+      code  = 'XYZ'
+    elif how == 'glued' and toks:
+      code  = code + toks.pop(0)
+    elif how == 'typo' and len(code) > 2:
+      code  = code[1] + code[0] + code[2:]
+    return (how, code, toks)
+
+  def message(self, code = None):
+    '''Returns a triple: the SMS code that the message was made for, what was done to spoil it (None if it was not), and its text.'''
+    code  = code or self.rnd.choice(sorted(MSG_ASSOC.keys()))
+    toks  = self.tokens(MSG_ASSOC[code])
+    how   = None
+    txt   = code
+    if self.rnd.random() < self.invalid:
+      how, txt, toks  = self.spoil(code, toks)
+    return (code, how, ' '.join([txt] + toks))
+
+  def messages(self, cnt):
+    return [self.message() for _ in range(cnt)]
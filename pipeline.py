@@ -0,0 +1,73 @@
+# encoding: UTF-8
+import Queue
+import sys
+import threading
+from timeit import default_timer
+
+# Buckets that the depths of queues are counted in.
+DEPTHS  = [0, 1, 2, 4, 8, 16, 32, 64, 128]
+# How long a blocked stage waits before it looks whether it should stop.
+WAIT    = 0.1
+
+END = object()
+
+class Failed:
+  'What a stage that raised hands on, for the stage after it to raise again.'
+  def __init__(self, info):
+    self.info = info
+
+def ahead(its, size, sts, name):
+  '''Runs the iterator `its` in a thread of its own, no more than `size` items ahead of the generator that it returns.
+So the stage that makes the items (fetching rows, say) goes on while the next one (parsing them) does, until the queue between them is full; the Postgres calls of psycopg2 let go of the interpreter, and so does a pool of workers.
+An exception in `its` is raised again by the generator, once the items before it are taken; dropping the generator stops the thread.
+The depth of the queue, and the time spent waiting on it full (the stage after is the slower) or empty (this one is), go in the `stats.Stats` `sts`, under `name`.'''
+  que   = Queue.Queue(size)
+  stop  = threading.Event()
+  def put(item):
+    try:
+      que.put(item, False)
+    except Queue.Full:
+      sttm  = default_timer()
+      while not stop.is_set():
+        try:
+          que.put(item, True, WAIT)
+          break
+        except Queue.Full:
+          pass
+      sts.since('queue_full_seconds', sttm, queue = name)
+    sts.observe('queue_depth', que.qsize(), DEPTHS, queue = name)
+  def run():
+    try:
+      for item in its:
+        if stop.is_set(): break
+        put(item)
+      else:
+        put(END)
+    except:
+      put(Failed(sys.exc_info()))
+    finally:
+      if hasattr(its, 'close'): its.close()
+  def drain():
+    try:
+      while True:
+        try:
+          item  = que.get(False)
+        except Queue.Empty:
+          sttm  = default_timer()
+          while True:
+            try:
+              item  = que.get(True, WAIT)
+              break
+            except Queue.Empty:
+              pass
+          sts.since('queue_empty_seconds', sttm, queue = name)
+        if item is END: return
+        if isinstance(item, Failed):
+          raise item.info[0], item.info[1], item.info[2]
+        yield item
+    finally:
+      stop.set()
+  thr         = threading.Thread(target = run, name = name)
+  thr.daemon  = True
+  thr.start()
+  return drain()
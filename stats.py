@@ -0,0 +1,249 @@
+# encoding: UTF-8
+import bisect
+import json
+import os, sys
+import threading
+import time as times
+from timeit import default_timer
+
+# Upper bounds (in seconds) of the buckets of timing histograms; the last bucket has none.
+BOUNDS  = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+class Histogram:
+  'How many observations fell under each of `bounds` (and above them all), with their count, sum, least and greatest.'
+  def __init__(self, bounds = BOUNDS):
+    self.bounds   = bounds
+    self.buckets  = [0] * (len(bounds) + 1)
+    self.count    = 0
+    self.sum      = 0.0
+    self.least    = None
+    self.most     = None
+
+  def observe(self, val):
+    self.buckets[bisect.bisect_left(self.bounds, val)] += 1
+    self.count  = self.count + 1
+    self.sum    = self.sum + val
+    if self.least is None or val < self.least: self.least = val
+    if self.most is None or val > self.most: self.most = val
+
+  def merge(self, other):
+    for ix, cnt in enumerate(other.buckets):
+      self.buckets[ix] += cnt
+    self.count  = self.count + other.count
+    self.sum    = self.sum + other.sum
+    for val in (other.least, other.most):
+      if val is not None:
+        if self.least is None or val < self.least: self.least = val
+        if self.most is None or val > self.most: self.most = val
+
+  def quantile(self, qtl):
+    'The upper bound of the bucket that the `qtl` quantile (0 to 1) falls in; the greatest observation, for the last bucket.'
+    if not self.count: return 0.0
+    seen  = 0
+    for ix, cnt in enumerate(self.buckets):
+      seen  = seen + cnt
+      if seen >= qtl * self.count:
+        return self.bounds[ix] if ix < len(self.bounds) else self.most
+    return self.most
+
+  def cumulative(self):
+    'The counts at or under every bound, and then the count of all, as Prometheus has them.'
+    ans = []
+    tot = 0
+    for cnt in self.buckets:
+      tot = tot + cnt
+      ans.append(tot)
+    return ans
+
+def labelled(name, labels):
+  return (name, tuple(sorted(labels.items())))
+
+class Stats:
+  '''Counters and timing histograms of a transfer, by name and labels (for instance, `parse_seconds` with `klass`, or `store_seconds` with `table`).
+Plain data throughout (but for the lock, which is made again), so that the stats of pool workers can be sent back and `merge`d.
+The threads of a pipeline share them: every change is made under `lock`, and what reads them all goes over copies taken under it.'''
+  def __init__(self):
+    self.counters   = {}
+    self.histograms = {}
+    self.started    = times.time()
+    self.lock       = threading.Lock()
+
+  def __getstate__(self):
+    return dict([(k, v) for k, v in self.__dict__.items() if k != 'lock'])
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.lock = threading.Lock()
+
+  def count(self, name, cnt = 1, **labels):
+    key = labelled(name, labels)
+    with self.lock:
+      self.counters[key]  = self.counters.get(key, 0) + cnt
+
+  def observe(self, name, val, bounds = BOUNDS, **labels):
+    key = labelled(name, labels)
+    with self.lock:
+      try:
+        self.histograms[key].observe(val)
+      except KeyError:
+        self.histograms[key]  = hst = Histogram(bounds)
+        hst.observe(val)
+
+  def since(self, name, sttm, **labels):
+    'Observes the time gone since `sttm` (a `default_timer` reading), and returns the time now, to start the next one from.'
+    now = default_timer()
+    self.observe(name, now - sttm, **labels)
+    return now
+
+  def timed(self, name, its, label = None, value = None):
+    '''Yields the items of the iterator `its`, observing the time that each took to come under `name`.
+With a `label`, the time is labelled with it, as `value` (a function of the item) has it.'''
+    its   = iter(its)
+    hsts  = {}
+    while True:
+      sttm  = default_timer()
+      got   = next(its)
+      lbl   = value(got) if label else None
+      took  = default_timer() - sttm
+      with self.lock:
+        try:
+          hst = hsts[lbl]
+        except KeyError:
+          key = labelled(name, {label: lbl} if label else {})
+          hst = hsts[lbl] = self.histograms.setdefault(key, Histogram())
+        hst.observe(took)
+      yield got
+
+  def merge(self, other):
+    'Adds in the figures of `other`, which no other thread is changing (those of a worker, sent back).'
+    with self.lock:
+      for key, cnt in other.counters.iteritems():
+        self.counters[key]  = self.counters.get(key, 0) + cnt
+      for key, hst in other.histograms.iteritems():
+        if key in self.histograms:
+          self.histograms[key].merge(hst)
+        else:
+          self.histograms[key]  = mine = Histogram(hst.bounds)
+          mine.merge(hst)
+
+  def copy(self):
+    '''A copy of the counters, and of the histograms, taken under the lock: a pair of lists of (key, figure).
+The histograms are copies too, so that they are not observed while they are read.'''
+    with self.lock:
+      cnts  = self.counters.items()
+      hsts  = []
+      for key, hst in self.histograms.iteritems():
+        mine  = Histogram(hst.bounds)
+        mine.merge(hst)
+        hsts.append((key, mine))
+    return (cnts, hsts)
+
+  def total(self, name):
+    'The sum of the counter, or of the observations of the histogram, `name` over all its labels.'
+    cnts, hsts  = self.copy()
+    return sum([cnt for (nom, lbls), cnt in cnts if nom == name] +
+               [hst.sum for (nom, lbls), hst in hsts if nom == name])
+
+  def counter(self, name, **labels):
+    'The count of `name` with just those `labels`.'
+    with self.lock:
+      return self.counters.get(labelled(name, labels), 0)
+
+  def summary(self, names):
+    'One line of the time spent under each of `names`.'
+    return ', '.join(['%s %.2fs' % (nom.replace('_seconds', ''), self.total(nom)) for nom in names])
+
+  def snapshot(self):
+    'All the figures, as a dict that goes to JSON.'
+    def key(nom, lbls):
+      return nom + ('{%s}' % (','.join(['%s=%s' % kv for kv in lbls]),) if lbls else '')
+    cnts, hsts  = self.copy()
+    return {
+      'time':       times.time(),
+      'uptime':     times.time() - self.started,
+      'counters':   dict([(key(nom, lbls), cnt) for (nom, lbls), cnt in cnts]),
+      'histograms': dict([(key(nom, lbls), {
+          'count':  hst.count,
+          'sum':    hst.sum,
+          'min':    hst.least,
+          'max':    hst.most,
+          'p50':    hst.quantile(0.5),
+          'p90':    hst.quantile(0.9),
+          'p99':    hst.quantile(0.99)
+        }) for (nom, lbls), hst in hsts])
+    }
+
+  def prometheus(self, prefix = 'transfer_'):
+    'All the figures, in the text format of Prometheus (as the textfile collector of node_exporter reads it).'
+    def lbl(lbls, *more):
+      got = list(lbls) + list(more)
+      return ('{%s}' % (','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in got]),)) if got else ''
+    cnts, hsts  = self.copy()
+    ans   = []
+    seen  = set()
+    for (nom, lbls), cnt in sorted(cnts):
+      if nom not in seen:
+        ans.append('# TYPE %s%s_total counter' % (prefix, nom))
+        seen.add(nom)
+      ans.append('%s%s_total%s %d' % (prefix, nom, lbl(lbls), cnt))
+    for (nom, lbls), hst in sorted(hsts):
+      if nom not in seen:
+        ans.append('# TYPE %s%s histogram' % (prefix, nom))
+        seen.add(nom)
+      for bnd, cnt in zip([repr(bnd) for bnd in hst.bounds] + ['+Inf'], hst.cumulative()):
+        ans.append('%s%s_bucket%s %d' % (prefix, nom, lbl(lbls, ('le', bnd)), cnt))
+      ans.append('%s%s_sum%s %r' % (prefix, nom, lbl(lbls), hst.sum))
+      ans.append('%s%s_count%s %d' % (prefix, nom, lbl(lbls), hst.count))
+    return '\n'.join(ans) + '\n'
+
+def dump(sts, path, fmt = 'json', **extra):
+  '''Writes out the stats `sts` to `path`: as a line of JSON (with the `extra` items too), added to what is there, or (`fmt` prometheus) as a Prometheus text file, replaced whole.
+The text file is written aside and moved into place, so that a scraper never reads half of it.'''
+  if fmt == 'prometheus':
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as fch:
+      fch.write(sts.prometheus())
+    os.rename(tmp, path)
+    return
+  got = sts.snapshot()
+  got.update(extra)
+  with open(path, 'a') as fch:
+    fch.write(json.dumps(got, sort_keys = True) + '\n')
+
+class Progress:
+  '''Shows how far along `total` messages a transfer is, with its rate and the time it has left, no more often than `every` seconds.
+Nothing is shown if `out` is None.'''
+  def __init__(self, total, out = sys.stdout, every = 1.0, width = 80):
+    self.total  = float(max(total, 1))
+    self.out    = out
+    self.every  = every
+    self.width  = width
+    self.sttm   = default_timer()
+    self.due    = self.sttm
+
+  def tick(self, pos):
+    'Notes that `pos` messages are done; shows it, if it is time to.'
+    if self.out is None: return
+    now = default_timer()
+    if now < self.due: return
+    self.due  = now + self.every
+    self.show(pos, now)
+
+  def show(self, pos, now):
+    pct = (pos / self.total) * 100.0
+    rte = pos / max(now - self.sttm, 1e-6)
+    lft = clock((self.total - pos) / rte if rte else 0)
+    rsp = '%d %3.1f%% %.0f/s %s left' % (pos, pct, rte, lft)
+    self.out.write('\r' + rsp.ljust(self.width)[0:self.width])
+    self.out.flush()
+
+  def done(self, pos):
+    if self.out is None: return
+    self.show(pos, default_timer())
+    self.out.write('\n')
+
+def clock(secs):
+  'Seconds, as `datetime.timedelta` shows them (to the second).'
+  mins, secs  = divmod(int(secs), 60)
+  hrs, mins   = divmod(mins, 60)
+  return '%d:%02d:%02d' % (hrs, mins, secs)
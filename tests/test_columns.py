@@ -0,0 +1,36 @@
+# encoding: UTF-8
+import unittest
+from messages import rmessages
+
+def code_fields():
+  for klass in set(rmessages.MSG_ASSOC.values()):
+    for step in klass.plan().steps:
+      if step.field.dbtype() in ('BOOLEAN', 'SMALLINT'):
+        yield step.field
+
+class ColumnTest(unittest.TestCase):
+  'The typed columns of coded fields, and reading the codes back from them.'
+  def test_types(self):
+    self.assertEqual(rmessages.GenderField.dbtype(), 'BOOLEAN')
+    self.assertEqual(rmessages.SymptomCodeField.dbtype(), 'SMALLINT')
+    self.assertEqual(rmessages.NBCField.dbtype(), 'INTEGER')
+    self.assertEqual(rmessages.IDField.dbtype(), 'TEXT')
+
+  def test_round_trip(self):
+    for fld in code_fields():
+      for cod in fld.codes().codes:
+        for spelt in [cod, cod.lower(), unicode(cod)]:
+          val = fld.column_value(fld.convert(spelt))
+          self.assertEqual(type(val), type(True) if fld.dbtype() == 'BOOLEAN' else type(1), (fld, spelt))
+          self.assertEqual(fld.column_code(val), cod, (fld, spelt))
+
+  def test_ordinals(self):
+    self.assertEqual(rmessages.PregCodeField.column_value('NH'), 11)
+    self.assertEqual(rmessages.PregCodeField.column_code(11), 'NH')
+    self.assertEqual(rmessages.PregCodeField.column_value('NH'), int(rmessages.PregCodeField.fixed_for_db('NH')))
+    self.assertEqual(rmessages.PregCodeField.column_code(10), None)
+    self.assertEqual(rmessages.GenderField.column_code(None), None)
+    self.assertEqual(rmessages.NumberField.column_code(3), 3)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,148 @@
+# encoding: UTF-8
+import unittest
+from datetime import datetime
+from messages import rmessages
+
+AD  = datetime(2026, 3, 1, 12, 0)
+
+# What the parser made of these messages before it was compiled into plans (and still must): the message class, and the data of the entries, or else the errors, as (code, field, token position).
+CORPUS  = [
+  ('DEP 0530504004812695 0156350026435427 x 27.4.2025 ', 'DepMessage', None, [('bad_date', 'DateField', 3), ('bad_text', 'Superfluous text: "27.4.2025"', 4)]),
+  ('PNC 2914714067583655 X 15.9.2025 ZZ DI PR CD MW ', 'PNCMessage', None, [('pnc_code', 'PNCField', 2), ('pnc_invalid_code_field_symptom', 'SymptomCodeField', 4), ('pnc_invalid_code_field_intervention_field', 'InterventionField', 5), ('pnc_invalid_code_field_health_status', 'MotherHealthStatusField', 6), ('bad_text', 'Superfluous text: "CD MW"', 7)]),
+  ('PRE 824389112245204 18.13.2027 20.9.2025 3a 3a MU CH CM CL WT50.5 ZZ NH\n', 'PregMessage', None, [('bad_indangamuntu', 'IDField', 1), ('impossible_date', 'LMPDateField', 2), ("invalid literal for int() with base 10: '3a'", 'GravidityField', 4), ("invalid literal for int() with base 10: '3a'", 'ParityField', 4), ('pre_invalid_code_field_pregnancy', 'PregCodeField', 4), ('pre_invalid_code_field_symptom', 'SymptomCodeField', 5), ('pre_invalid_code_field_location', 'LocationField', 6), ('bad_floated_field', 'WeightField', 7), ('pre_invalid_code_field_toilet', 'ToiletField', 8), ('pre_invalid_code_field_handwash', 'HandwashField', 9), ('bad_text', 'Superfluous text: "WT50.5 ZZ NH"', 10)]),
+  ('Chi \n 0132810951505986 \n 2 \n 24.7.2027 \n v2 \n SA \n DB \n FE \n HO \n W\n', 'ChildMessage', None, [('chi_invalid_code_field_code', 'VaccinationCompletionField', 5), ('bad_floated_field', 'WeightField', 9), ('chi_missing_fields', 'MUACField', 10)]),
+  ('DEP \n 1269846706977417 \n x\n', 'DepMessage', None, [('bad_number', 'NumberField', 2), ('dep_missing_fields', 'DateField', 3)]),
+  ('CCM\t9818963510965948\t2\t10.4.2026\tCM\tNA\tMU1 ', 'CCMMessage', None, [('bad_muac_code', 'MUACField', 6)]),
+  ('PNC \n 1071475355715227 \n PNC1 \n 29.6.2026 \n OE \n MA \n TR \n MS', 'PNCMessage', {'daymonthyear': datetime(2026, 6, 29), 'health_status': False, 'indangamuntu': '1071475355715227', 'intervention_field': 'TR', 'pnc_visit': 1, 'symptom': ['OE', 'MA']}, []),
+  ('CBN  2067817618929349  1  16.5.2025  CBF  HT  WT12  MUAC12  X', 'CBNMessage', None, [('nbc_code', 'BreastFeedField', 4), ('bad_numbered_field', 'HeightField', 5), ('bad_muac_code', 'MUACField', 7), ('bad_text', 'Superfluous text: "X"', 8)]),
+  ('RES 4982195700640968 ZZ NA MW', 'ResultMessage', None, [('res_invalid_code_field_symptom', 'SymptomCodeField', 2), ('res_invalid_code_field_location', 'LocationField', 3), ('res_invalid_code_field_intervention_field', 'InterventionField', 4), ('res_missing_fields', 'MotherHealthStatusField', 5)]),
+  ('ANC or 3725130207514918 16.11.2026 X SB NS DS CL WT12', 'ANCMessage', None, [('bad_indangamuntu', 'IDField', 1), ('bad_date', 'DateField', 2), ("invalid literal for int() with base 10: '16.11.2026'", 'ANCField', 3), ('anc_invalid_code_field_symptom', 'SymptomCodeField', 3), ('anc_invalid_code_field_location', 'LocationField', 4), ('bad_floated_field', 'WeightField', 5), ('bad_text', 'Superfluous text: "NS DS CL WT12"', 6)]),
+  ('NBC \n 2995293303452502 \n 2 \n NBC1 \n 19.7.2027 \n VO \n DS \n PT \n ZZ', 'NBCMessage', None, [('nbc_invalid_code_field_breastfeeding', 'BreastFeedField', 7), ('nbc_invalid_code_field_intervention_field', 'NBCInterventionField', 8), ('nbc_missing_fields', 'NewbornHealthStatusField', 9)]),
+  ('PNC  885866201318566  PNC1  25.10.2026  CH  DB  TR  ZZ\n', 'PNCMessage', None, [('bad_indangamuntu', 'IDField', 1), ('pnc_invalid_code_field_health_status', 'MotherHealthStatusField', 7)]),
+  ('pre 3953420182922513 26.9.2027 12 1 KX OL HP WT12 NT hw', 'PregMessage', None, [('incoherent_date_periods', 'LMPDateField', 2), ('bad_date', 'DateField', 3), ('bad_number', 'ParityField', 5), ('pre_invalid_code_field_symptom', 'SymptomCodeField', 7), ('pre_invalid_code_field_location', 'LocationField', 8), ('bad_floated_field', 'WeightField', 9), ('pre_invalid_code_field_toilet', 'ToiletField', 10), ('pre_missing_fields', 'HandwashField', 11)]),
+  ('pre \n 9941103022587445 \n 11.1.2025 \n 12 \n x \n FP \n ZZ \n WT50.5 \n ZZ \n HW\n', 'PregMessage', None, [('bad_date', 'DateField', 3), ('bad_number', 'GravidityField', 4), ('bad_number', 'ParityField', 5), ('pre_invalid_code_field_pregnancy', 'PregCodeField', 6), ('pre_invalid_code_field_symptom', 'SymptomCodeField', 7), ('pre_invalid_code_field_location', 'LocationField', 8), ('bad_floated_field', 'WeightField', 9), ('pre_missing_fields', 'ToiletField', 10), ('pre_missing_fields', 'HandwashField', 10)]),
+  ('Chi \n 1569767450729631 \n 3a \n 4.1.2026 \n V2 \n MS \n VI \n NS \n HO \n WT5x \n MUAC12.5', 'ChildMessage', None, [("invalid literal for int() with base 10: '3a'", 'NumberField', 2), ('bad_date', 'DateField', 2), ('chi_invalid_code_field_vacc_completion', 'VaccinationField', 3), ('chi_invalid_code_field_code', 'VaccinationCompletionField', 4), ('chi_invalid_code_field_symptom', 'SymptomCodeField', 5), ('chi_invalid_code_field_location', 'LocationField', 6), ('bad_floated_field', 'WeightField', 7), ('bad_muac_code', 'MUACField', 8), ('bad_text', 'Superfluous text: "WT5x \n MUAC12.5"', 9)]),
+  ('ANC \n 6177529382272941 \n x \n 13.9.2027 \n PNC1 \n WT50.5\n', 'ANCMessage', None, [('bad_date', 'DateField', 2), ("invalid literal for int() with base 10: '13.9.2027'", 'ANCField', 3), ('anc_invalid_code_field_symptom', 'SymptomCodeField', 3), ('anc_invalid_code_field_location', 'LocationField', 4)]),
+  ('DEP  706333102391923  x  2.7.2026\n', 'DepMessage', None, [('bad_indangamuntu', 'IDField', 1), ('bad_number', 'NumberField', 2)]),
+  ('Chi \n 9940939681724881 \n 2 \n 12.2.2025 \n V1 \n VC \n NP \n NS \n FP \n OR \n WT12 \n MUAC12\n', 'ChildMessage', None, [('bad_muac_code', 'MUACField', 11)]),
+  ('NBC\t1140450607750539\tx\t26.3.2027\tvo\tZZ\tTR\tCS\n', 'NBCMessage', None, [('bad_number', 'NumberField', 2), ('nbc_invalid_code_field_nbc_visit', 'NBCField', 3), ('bad_date', 'DateField', 4), ('nbc_invalid_code_field_symptom', 'SymptomCodeField', 5), ('nbc_invalid_code_field_breastfeeding', 'BreastFeedField', 6), ('nbc_invalid_code_field_intervention_field', 'NBCInterventionField', 7), ('nbc_missing_fields', 'NewbornHealthStatusField', 8)]),
+  ('CCM \n 3011968171563855 \n 1 \n SA \n ZZ \n TR \n MUAC12.5 \n extra', 'CCMMessage', None, [('bad_date', 'DateField', 3), ('ccm_invalid_code_field_symptom', 'SymptomCodeField', 4), ('bad_text', 'Superfluous text: "extra"', 7)]),
+  ('RED SC AP CO OR ', 'RedMessage', {'location': 'OR', 'red_symptom': ['SC', 'AP', 'CO']}, []),
+  ('ANC 1325526419210687 9.1.2026 PNC1 fp DB OR ZZ WT50.5 ', 'ANCMessage', None, [('bad_floated_field', 'WeightField', 7), ('bad_text', 'Superfluous text: "WT50.5"', 8)]),
+  ('REF \n 0670538880899121 \n 0686200723402273 ', 'RefMessage', None, [('bad_text', 'Superfluous text: "0686200723402273"', 2)]),
+  ('XYZ  extra ', 'UnknownMessage', None, [('bad_text', 'Superfluous text: "extra"', 1)]),
+  ('RES\t5280810279044714\tDB\tHO\tPR\tZZ ', 'ResultMessage', None, [('res_invalid_code_field_health_status', 'MotherHealthStatusField', 5)]),
+  ('DTH 080229538245776 2 27.9.2027 ho MD', 'DeathMessage', None, [('bad_indangamuntu', 'IDField', 1)]),
+  ('REF  0112351319719139', 'RefMessage', {'indangamuntu': '0112351319719139'}, []),
+  ('RED\tCL ', 'RedMessage', None, [('red_invalid_code_field_red_symptom', 'RedSymptomCodeField', 1), ('red_missing_fields', 'LocationField', 2)]),
+  ('RED\tSC\tZZ ', 'RedMessage', None, [('red_invalid_code_field_location', 'LocationField', 2)]),
+  ('DTH\t7864529368842518\tx\t12.4.2026\tcl\tCD ', 'DeathMessage', None, [('bad_number', 'NumberField', 2)]),
+  ('XYZ\n', 'UnknownMessage', None, ['Extend semantics_check.']),
+  ('RES  520978369863483  VO  DI  HP  pt  ZZ\n', 'ResultMessage', None, [('bad_indangamuntu', 'IDField', 1), ('res_invalid_code_field_health_status', 'MotherHealthStatusField', 6)]),
+  ('RISK\t305727926642277\tSA\tOR\tWT5x', 'RiskMessage', None, [('bad_indangamuntu', 'IDField', 1)]),
+  ('CCM  3545109316715350  x  16.8.2025  fe  SA  DB  AA  MUAC12.5\n', 'CCMMessage', None, [('bad_number', 'NumberField', 2)]),
+  ('NBC \n 864384612075182 \n WT5x \n 1 \n NBC1 \n 16.5.2027 \n TR \n CS', 'NBCMessage', None, [('bad_indangamuntu', 'IDField', 1), ('bad_number', 'NumberField', 2), ('nbc_invalid_code_field_nbc_visit', 'NBCField', 3), ('bad_date', 'DateField', 4), ('nbc_invalid_code_field_symptom', 'SymptomCodeField', 5), ('nbc_invalid_code_field_breastfeeding', 'BreastFeedField', 6), ('nbc_invalid_code_field_intervention_field', 'NBCInterventionField', 7), ('nbc_missing_fields', 'NewbornHealthStatusField', 8)]),
+  ('CMR 7290831085149251 3a 7.2.2025 DI NS PT cw\n', 'CMRMessage', None, [("invalid literal for int() with base 10: '3a'", 'NumberField', 2), ('bad_date', 'DateField', 2), ('cmr_invalid_code_field_symptom', 'SymptomCodeField', 3), ('cmr_invalid_code_field_intervention_field', 'InterventionField', 4), ('cmr_invalid_code_field_health_status', 'NewbornHealthStatusField', 5), ('bad_text', 'Superfluous text: "PT cw"', 6)]),
+  ('RED \n AP \n CL \n X\n', 'RedMessage', None, [('bad_text', 'Superfluous text: "X"', 3)]),
+  ('RAR\t4923615952451112\t9.4.2025\tNS\tNS\tHP\tNA\tMW', 'RedResultMessage', {'daymonthyear': datetime(2025, 4, 9), 'health_status': True, 'indangamuntu': '4923615952451112', 'intervention_field': 'NA', 'location': 'HP', 'symptom': ['NS', 'NS']}, []),
+  ('BIR \n 8892490054975955 \n 2 \n 19.5.2027 \n BO \n MA \n ZZ \n ebf', 'BirMessage', None, [('bir_invalid_code_field_location', 'LocationField', 6), ('nbc_code', 'BreastFeedField', 7), ('bir_missing_fields', 'WeightField', 8)]),
+  ('CMR \n 1166396047360385 \n 1 \n 18.4.2026 \n NP \n CI \n PR \n cw', 'CMRMessage', {'daymonthyear': datetime(2026, 4, 18), 'health_status': True, 'indangamuntu': '1166396047360385', 'intervention_field': 'PR', 'number': 1, 'symptom': ['NP', 'CI']}, []),
+  ('RISK\t7392952417285326\tOR\tWT12 ', 'RiskMessage', None, [('risk_invalid_code_field_symptom', 'SymptomCodeField', 2), ('risk_invalid_code_field_location', 'LocationField', 3), ('risk_missing_fields', 'WeightField', 4)]),
+  ('CMR\t602172970637820\t12\t22.10.2027\tCH\tFP\tAA\tcw\n', 'CMRMessage', None, [('bad_indangamuntu', 'IDField', 1)]),
+  ('DEP\t1640635455311851\t2\t17.4.2026', 'DepMessage', {'daymonthyear': datetime(2026, 4, 17), 'indangamuntu': '1640635455311851', 'number': 2}, []),
+  ('PNC\t4048577197183195\tANC2\t2.4.2026\tAL\tZZ\n', 'PNCMessage', None, [('pnc_invalid_code_field_symptom', 'SymptomCodeField', 4), ('pnc_invalid_code_field_intervention_field', 'InterventionField', 5), ('pnc_missing_fields', 'MotherHealthStatusField', 6)]),
+  ('RES 0605819621485101 MA OE CM hp PR mw', 'ResultMessage', {'health_status': True, 'indangamuntu': '0605819621485101', 'intervention_field': 'PR', 'location': 'hp', 'symptom': ['MA', 'OE', 'CM']}, []),
+  ('RISK 1158692376463040 JA DB CO ZZ WT5x\n', 'RiskMessage', None, [('risk_invalid_code_field_location', 'LocationField', 4), ('bad_floated_field', 'WeightField', 5), ('bad_text', 'Superfluous text: "WT5x"', 6)]),
+  ('BIR 5556637277737942 x 1.7.2026 ZZ CL NB WT50.5', 'BirMessage', None, [('bad_number', 'NumberField', 2), ('bir_invalid_code_field_gender', 'GenderField', 4), ('bir_invalid_code_field_symptom', 'SymptomCodeField', 5), ('bir_invalid_code_field_location', 'LocationField', 6), ('bir_invalid_code_field_breastfeeding', 'BreastFeedField', 7), ('bir_missing_fields', 'WeightField', 8)]),
+  ('REF\tZZ\t0349334190692632\textra', 'RefMessage', None, [('bad_phone_id', 'PhoneBasedIDField', 1), ('bad_text', 'Superfluous text: "0349334190692632\textra"', 2)]),
+  ('DTH  5663652629475421  12  17.11.2025  HP  ZZ  extra\n', 'DeathMessage', None, [('dth_invalid_code_field_death', 'DeathField', 5), ('bad_text', 'Superfluous text: "extra"', 6)]),
+  ('CMR  8068247630437246  2  18.13.2025  FE  DS  RB  NA  CW\n', 'CMRMessage', None, [('impossible_date', 'DateField', 3)]),
+  ('CBN  0922328554038882  1  12.7.2026  ZZ  150  WT50.5  MUAC12', 'CBNMessage', None, [('cbn_invalid_code_field_breastfeeding', 'BreastFeedField', 4), ('bad_muac_code', 'MUACField', 7)]),
+  ('RISK  8549480460805195  OE  DI  SB  HO  WT50.5 ', 'RiskMessage', {'indangamuntu': '8549480460805195', 'location': 'HO', 'symptom': ['OE', 'DI', 'SB'], 'weight': 50.5}, []),
+  ('RAR 782959197282142 29.9.2027 SA or PT mw ', 'RedResultMessage', None, [('bad_indangamuntu', 'IDField', 1)]),
+  ('BIR 4674314217541712 3a ZZ CH AF OR CBF WT5x extra ', 'BirMessage', None, [("invalid literal for int() with base 10: '3a'", 'NumberField', 2), ('bad_date', 'DateField', 2), ('bir_invalid_code_field_gender', 'GenderField', 3), ('nbc_code', 'BreastFeedField', 7), ('bad_text', 'Superfluous text: "extra"', 9)]),
+  ('CCM  6772206229656563  1  12.2.2025  OE  AA  MUAC12.5\n', 'CCMMessage', {'daymonthyear': datetime(2025, 2, 12), 'indangamuntu': '6772206229656563', 'intervention_field': 'AA', 'muac': 12.5, 'number': 1, 'symptom': ['OE']}, []),
+  ('CBN 237212336480682 12 15.10.2025 CBF HT WT50.5 MUAC12', 'CBNMessage', None, [('bad_indangamuntu', 'IDField', 1), ('nbc_code', 'BreastFeedField', 4), ('bad_numbered_field', 'HeightField', 5), ('bad_muac_code', 'MUACField', 7)]),
+  ('RAR\t3514613656752485\t12.6.2027\tCI\tAF\tZZ\tZZ\tNA\tMS\n', 'RedResultMessage', None, [('rar_invalid_code_field_location', 'LocationField', 5), ('rar_invalid_code_field_intervention_field', 'InterventionField', 6), ('rar_invalid_code_field_health_status', 'MotherHealthStatusField', 7), ('bad_text', 'Superfluous text: "MS"', 8)]),
+  ('DTH  1048247215498254  12  10.8.2027  CL  ND', 'DeathMessage', {'daymonthyear': datetime(2027, 8, 10), 'death': 'ND', 'indangamuntu': '1048247215498254', 'location': 'CL', 'number': 12}, []),
+  ('RAR 5799139592092535 30.12.2025 FP DB NP OR PR MW 0479952597684581 ', 'RedResultMessage', None, [('bad_text', 'Superfluous text: "0479952597684581"', 9)]),
+  ('Chi \n 9855132163758085 \n 2 \n 13.10.2026 \n v2 \n NV \n HY \n RB \n HO \n WT12 \n MUAC12.5\n', 'ChildMessage', {'code': 'NV', 'daymonthyear': datetime(2026, 10, 13), 'indangamuntu': '9855132163758085', 'location': 'HO', 'muac': 12.5, 'number': 2, 'symptom': ['HY', 'RB'], 'vacc_completion': 2, 'weight': 12.0}, []),
+  ('REF ', 'RefMessage', None, [('ref_missing_fields', 'PhoneBasedIDField', 1)]),
+  ('ANC 2257681206913518 23.2.2027 PNC1 DI CL WT5x ', 'ANCMessage', {'anc_visit': 1, 'daymonthyear': datetime(2027, 2, 23), 'indangamuntu': '2257681206913518', 'location': 'CL', 'symptom': ['DI'], 'weight': 5.0}, []),
+  ('', 'UnknownMessage', None, ['Extend semantics_check.']),
+  ('   ', 'UnknownMessage', None, ['Extend semantics_check.']),
+  ('PRE', 'PregMessage', None, [('pre_missing_fields', 'IDField', 1), ('pre_missing_fields', 'LMPDateField', 1), ('pre_missing_fields', 'DateField', 1), ('pre_missing_fields', 'GravidityField', 1), ('pre_missing_fields', 'ParityField', 1), ('pre_missing_fields', 'PregCodeField', 1), ('pre_missing_fields', 'SymptomCodeField', 1), ('pre_missing_fields', 'LocationField', 1), ('pre_missing_fields', 'WeightField', 1), ('pre_missing_fields', 'ToiletField', 1), ('pre_missing_fields', 'HandwashField', 1)]),
+  ('RED', 'RedMessage', None, [('red_missing_fields', 'RedSymptomCodeField', 1), ('red_missing_fields', 'LocationField', 1)]),
+  ('RED AP', 'RedMessage', None, [('red_missing_fields', 'LocationField', 2)]),
+  ('RED AP HO', 'RedMessage', {'location': 'HO', 'red_symptom': ['AP']}, []),
+  ('RED ap ho x', 'RedMessage', None, [('bad_text', 'Superfluous text: "x"', 3)]),
+  (u'RED AP HO', 'RedMessage', {'location': u'HO', 'red_symptom': [u'AP']}, []),
+  (u'red ap\tho\n', 'RedMessage', {'location': u'ho', 'red_symptom': [u'ap']}, []),
+  ('DEP 1234567890123456 3a 12.2.2026', 'DepMessage', None, [("invalid literal for int() with base 10: '3a'", 'NumberField', 2), ('bad_date', 'DateField', 2), ('bad_text', 'Superfluous text: "12.2.2026"', 3)]),
+  ('RISK 1234567890123456 CH HO WT3.5.6', 'RiskMessage', None, [('invalid literal for float(): 3.5.6', 'WeightField', 4), ('bad_text', 'Superfluous text: "WT3.5.6"', 4)]),
+  ('XYZ 1 2 3', 'UnknownMessage', None, [('bad_text', 'Superfluous text: "1 2 3"', 1)]),
+]
+
+# The errors that `ThouMessage.parse` keeps the text of the exception for, and that the exception-free paths give a code for instead.
+FAULTS  = [('invalid literal for int()', 'not_whole_number'), ('invalid literal for float()', 'not_real_number')]
+
+def spelt(errs, faulted = False):
+  'The `errors` of a message, as `CORPUS` gives them; with `faulted`, with the codes of the exception-free paths.'
+  ans = []
+  for err in errs:
+    if type(err) != type(()):
+      ans.append(err)
+      continue
+    cod, fld, at  = err
+    for pfx, flt in FAULTS:
+      if faulted and cod.startswith(pfx):
+        cod = flt
+    ans.append((cod, fld if isinstance(fld, basestring) else (fld[0] if type(fld) == type(()) else fld).__name__, at))
+  return ans
+
+def data(entries):
+  return dict([(sub, fob.data()) for sub, fob in entries.items()])
+
+class CorpusTest(unittest.TestCase):
+  'The parse of a fixed corpus, through each path, against what it was before the plans.'
+  def test_parse(self):
+    for msg, klass, vals, errs in CORPUS:
+      try:
+        got = rmessages.ThouMessage.parse(msg, AD)
+      except rmessages.ThouMsgError, e:
+        self.assertEqual((e.message.__class__.__name__, None, spelt(e.errors)), (klass, vals, errs), repr(msg))
+        continue
+      self.assertEqual((got.__class__.__name__, data(got.entries), []), (klass, vals, errs), repr(msg))
+
+  def test_results(self):
+    for msg, klass, vals, errs in CORPUS:
+      rst = rmessages.ThouMessage.attempt(msg, AD)
+      self.assertEqual(rst.klass.__name__, klass, repr(msg))
+      self.assertEqual(rst.success, vals is not None, repr(msg))
+      if rst.success:
+        self.assertEqual(data(rst.entries), vals, repr(msg))
+        for sub, val in vals.items():
+          self.assertEqual(rst.value(sub), tuple(val) if type(val) == type([]) else val, (msg, sub))
+        self.assertEqual(rst.reach, None)
+        got = rst.unwrap()
+        self.assertEqual((got.__class__.__name__, data(got.entries)), (klass, vals), repr(msg))
+        continue
+      self.assertEqual(spelt(rst.errors, True), spelt(errs, True), repr(msg))
+      ats = [err[2] for err in errs if type(err) == type(())]
+      self.assertEqual(rst.reach, min(ats) if ats else None, repr(msg))
+      self.assertEqual(rst.message.__class__.__name__, klass, repr(msg))
+      try:
+        rst.unwrap()
+        self.fail(repr(msg))
+      except rmessages.ThouMsgError, e:
+        self.assertEqual((e.message.__class__.__name__, e.errors), (klass, rst.errors), repr(msg))
+
+  def test_parse_many(self):
+    rsts  = list(rmessages.ThouMessage.parse_many([(msg, AD) for msg, klass, vals, errs in CORPUS]))
+    self.assertEqual(len(rsts), len(CORPUS))
+    for (msg, klass, vals, errs), rst in zip(CORPUS, rsts):
+      one = rmessages.ThouMessage.attempt(msg, AD)
+      self.assertEqual((rst.klass, rst.code, rst.text, rst.values, rst.errors), (one.klass, one.code, one.text, one.values, one.errors), repr(msg))
+
+if __name__ == '__main__':
+  unittest.main()
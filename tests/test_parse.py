@@ -0,0 +1,94 @@
+# encoding: UTF-8
+import unittest
+from datetime import datetime
+from messages import rmessages
+from messages.parser import ThouField, ThouPlan
+
+AD  = datetime(2026, 3, 1, 12, 0)
+
+def parse_errors(msg):
+  'The error codes that `ThouMessage.parse` raises with for `msg`.'
+  try:
+    rmessages.ThouMessage.parse(msg, AD)
+  except rmessages.ThouMsgError, e:
+    return [err[0] for err in e.errors]
+  return []
+
+def attempt_errors(msg):
+  return [err[0] for err in rmessages.ThouMessage.attempt(msg, AD).errors]
+
+class FaultTest(unittest.TestCase):
+  'Conversions that fail without raising, and what each path reports of them.'
+  def test_whole(self):
+    self.assertEqual(rmessages.whole('12'), (12, []))
+    self.assertEqual(rmessages.whole(u'-4'), (-4, []))
+    for txt in ['3a', u'3a', '1_', '']:
+      val, err = rmessages.whole(txt)
+      self.assertEqual((val, str(err)), (None, 'not_whole_number'), repr(txt))
+      self.assertEqual(err.legacy(), 'invalid literal for int() with base 10: %r' % (str(txt),))
+
+  def test_real(self):
+    for txt, val in [('3.5', 3.5), ('5.', 5.0), (u'.5', 0.5), ('1e5', 1e5)]:
+      self.assertEqual(rmessages.real(txt), (val, []))
+    for txt in ['3.5.6', u'3.5.6', '3_5']:
+      val, err = rmessages.real(txt)
+      self.assertEqual((val, str(err)), (None, 'not_real_number'), repr(txt))
+      self.assertEqual(err.legacy(), 'invalid literal for float(): %s' % (txt,))
+
+  def test_paths(self):
+    msg = 'DEP 1234567890123456 3a 12.2.2026'
+    self.assertEqual(parse_errors(msg), ["invalid literal for int() with base 10: '3a'", 'bad_date', 'bad_text'])
+    self.assertEqual(attempt_errors(msg), ['not_whole_number', 'bad_date', 'bad_text'])
+    msg = 'RISK 1234567890123456 CH HO WT3.5.6'
+    self.assertEqual(parse_errors(msg), ['invalid literal for float(): 3.5.6', 'bad_text'])
+    self.assertEqual(attempt_errors(msg), ['not_real_number', 'bad_text'])
+
+class Ex(ThouField):
+  @classmethod
+  def expectations(self):
+    return ['X', 'Y', 'Z']
+
+class Why(ThouField):
+  @classmethod
+  def expectations(self):
+    return ['Y', 'V', 'W']
+
+class Queue(ThouField):
+  @classmethod
+  def expectations(self):
+    return ['Q', 'R', 'S']
+
+class PlanTest(unittest.TestCase):
+  'Backtracking over a repeated field that the field after it contests, and the position that is reported when there is no way through.'
+  def setUp(self):
+    self.plan = ThouPlan([(Ex, True), Why, Queue])
+
+  def test_contested(self):
+    self.assertEqual(self.plan.contested, frozenset([0]))
+    self.assertEqual(ThouPlan([(Ex, True), Queue]).contested, frozenset())
+    for klass in rmessages.MSG_ASSOC.values():
+      self.assertEqual(klass.plan().contested, frozenset(), klass)
+
+  def test_backtracks(self):
+    self.assertEqual(self.plan.values('t', 'X Y Q', AD), ((('X',), 'Y', 'Q'), []))
+    self.assertEqual(self.plan.values('t', 'X Z Y Y R', AD), ((('X', 'Z', 'Y'), 'Y', 'R'), []))
+    self.assertEqual(self.plan.values('t', 'X Y V S', AD), ((('X', 'Y'), 'V', 'S'), []))
+
+  def test_furthest(self):
+    vals, errs  = self.plan.values('t', 'X Y X Q', AD)
+    self.assertEqual([(err, at) for err, fld, at in errs], [('t_invalid_code_field_why', 4), ('t_missing_fields', 5)])
+    self.assertEqual(ThouPlan.furthest(errs), 4)
+    vals, errs  = self.plan.values('t', 'X Y', AD)
+    self.assertEqual([(err, at) for err, fld, at in errs], [('t_missing_fields', 3)])
+    self.assertEqual(ThouPlan.furthest([]), None)
+
+  def test_bounded(self):
+    vals, errs  = self.plan.values('t', ' '.join(['X Y'] * 200 + ['Q', 'Q']), AD)
+    self.assertEqual([(err, at) for err, fld, at in errs], [('bad_text', 402)])
+
+  def test_reach(self):
+    self.assertEqual(rmessages.ThouMessage.attempt('DEP 1234567890123456 3a 12.2.2026', AD).reach, 2)
+    self.assertEqual(rmessages.ThouMessage.attempt('DEP 1234567890123456 3 12.2.2026', AD).reach, None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,54 @@
+# encoding: UTF-8
+import unittest
+from messages import rmessages
+from messages.parser import ThouTrie
+
+class TrieTest(unittest.TestCase):
+  'The edit distance that `ThouTrie.near` goes by, and what `ThouTrie.closest` makes of it.'
+  def setUp(self):
+    self.trie = ThouTrie(['PRE', 'RED', 'REF', 'RES', 'RISK'])
+
+  def test_near(self):
+    self.assertEqual(sorted(self.trie.near('RISK', 0)), ['RISK'])
+    self.assertEqual(sorted(self.trie.near('RIS', 1)), ['RES', 'RISK'])
+    self.assertEqual(sorted(self.trie.near('RSIK', 1)), ['RISK'])
+    self.assertEqual(sorted(self.trie.near('RSIK', 0)), [])
+    self.assertEqual(sorted(self.trie.near('RK', 1)), [])
+    self.assertEqual(sorted(self.trie.near('RK', 2)), ['PRE', 'RED', 'REF', 'RES', 'RISK'])
+
+  def test_closest(self):
+    self.assertEqual(self.trie.closest('RED'), 'RED')
+    self.assertEqual(self.trie.closest('RIS'), 'RISK')
+    self.assertEqual(self.trie.closest('RE'), None)
+    self.assertEqual(self.trie.closest('PR'), 'PRE')
+    self.assertEqual(self.trie.closest('PRX'), 'PRE')
+
+  def test_closest_short(self):
+    self.assertEqual(self.trie.closest('PR', 1, 4), None)
+    self.assertEqual(self.trie.closest('PRX', 1, 4), None)
+    self.assertEqual(self.trie.closest('PER', 1, 4), 'PRE')
+    self.assertEqual(self.trie.closest('RIS', 1, 4), 'RISK')
+    self.assertEqual(self.trie.closest('RSIK', 1, 4), 'RISK')
+    self.assertEqual(self.trie.closest('RIKS', 1, 4), 'RISK')
+    self.assertEqual(self.trie.closest('RISKY', 1, 4), 'RISK')
+    self.assertEqual(self.trie.closest('RSKI', 1, 4), None)
+
+class RecoverTest(unittest.TestCase):
+  'Which unknown codes `ThouMessage.recover` puts right.'
+  def recovered(self, code):
+    klass, cod, rem = rmessages.ThouMessage.recover(code, '')
+    return None if klass is rmessages.UnknownMessage else cod
+
+  def test_recovered(self):
+    for code, kwd in [('PER', 'PRE'), ('ERD', 'RED'), ('HCI', 'CHI'), ('RIS', 'RISK'), ('RSIK', 'RISK'), ('PRE1234', 'PRE'), ('RISK1234', 'RISK')]:
+      self.assertEqual(self.recovered(code), kwd, code)
+
+  def test_left_alone(self):
+    for code in ['CHW', 'DET', 'CC', 'DE', 'AN', 'PR', 'CB', 'CM', 'RE', 'XYZ', '']:
+      self.assertEqual(self.recovered(code), None, code)
+
+  def test_glued(self):
+    self.assertEqual(rmessages.ThouMessage.recover('PRE1234', '12.1.2026'), (rmessages.PregMessage, 'PRE', '1234 12.1.2026'))
+
+if __name__ == '__main__':
+  unittest.main()
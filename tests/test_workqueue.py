@@ -0,0 +1,60 @@
+# encoding: UTF-8
+import unittest
+from datetime import datetime
+import benchdb
+import workqueue
+
+def message(ix):
+  return (ix, 1, 1, datetime(2026, 3, 1), 'DEP %016d 1 1.3.2026' % (ix,))
+
+class LeaseTest(unittest.TestCase):
+  'Rows that commit late, under where a lease has got to, are still handed out.'
+  def setUp(self):
+    self.db = benchdb.MemoryDB()
+    self.db.seed([message(ix) for ix in range(1, 101) if ix not in (75, 85)])
+    self.conn = self.db.connect()
+
+  def batch(self, que):
+    'Hands out a batch, stores it as treated, and checkpoints it, as `transferer.single_handle` does; returns the ids.'
+    got = [rep[0] for rep in que.fetch(1000)]
+    for fid in got:
+      self.db.insert('treated_messages', {'oldid': fid, 'success': True})
+    if got:
+      que.checkpoint(got[-1])
+    self.conn.commit()
+    return got
+
+  def leases(self):
+    return dict([(row['lo'], (row['lastid'], row['done'])) for row in self.db.tables[workqueue.LEASES]['rows']])
+
+  def test_late(self):
+    que = workqueue.LeaseQueue(self.conn, span = 40, lookback = 30)
+    self.assertEqual(self.batch(que), [ix for ix in range(1, 101) if ix not in (75, 85)])
+    # Only the first range is more than `lookback` ids under the greatest; the others are worked through, but not done.
+    self.assertEqual(self.leases(), {0: (40, True), 40: (80, False), 80: (100, False)})
+    self.db.seed([message(75), message(85)])
+    self.assertEqual(self.batch(que), [75, 85])
+    self.assertEqual(self.batch(que), [])
+
+  def test_done(self):
+    que = workqueue.LeaseQueue(self.conn, span = 40, lookback = 30)
+    self.batch(que)
+    self.db.seed([message(ix) for ix in range(101, 161)])
+    self.assertEqual(self.batch(que), range(101, 161))
+    self.assertEqual(self.leases(), {0: (40, True), 40: (80, True), 80: (120, True), 120: (160, False)})
+    # Under the lookback window by then: too late to be seen.
+    self.db.seed([message(75)])
+    self.assertEqual(self.batch(que), [])
+
+  def test_shared(self):
+    ques  = [workqueue.LeaseQueue(self.conn, span = 20, lookback = 30) for _ in range(3)]
+    got   = []
+    for que in ques:
+      got.extend(self.batch(que))
+    self.db.seed([message(75), message(85)])
+    for que in ques:
+      got.extend(self.batch(que))
+    self.assertEqual(sorted(got), range(1, 101))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,31 +1,51 @@
 # encoding: UTF-8
-import datetime
-from ectomorph import orm
-from messages import rmessages
-import re, sys, os
+import bulkwriter
+import collections
+import connections
+from messages import cache, rmessages
+import itertools, re, sys, os
+import listener
+import multiprocessing
 from optparse import OptionParser
+import pipeline
 import psycopg2
+import stats
 import time as times
+from timeit import default_timer
+import workqueue
 
 TREATED = ('treated_messages', [
   ('oldid',   0),
   ('success', True)
 ])
 FAILED  = 'failed_transfers'
-
-orm.ORM.connect(dbname = 'thousanddays', user = 'thousanddays', password = 'thousanddays')
+PARSER  = rmessages.ThouMessage
+STAGES  = ['fetch_seconds', 'parse_seconds', 'store_seconds', 'commit_seconds', 'checkpoint_seconds']
 
 def handle_messages(args, options):
   def gun():
-    postgres  = psycopg2.connect(
-          dbname = 'thousanddays',
-            user = 'thousanddays',
-        password = 'thousanddays'
-    )
-    once  = True
-    while once:
-      once  = single_handle(TREATED, postgres, args, options) and options.get('REPEAT', not once)
-    postgres.close()
+    wrks  = int(options.get('WORKERS', 0))
+    use_cache(options, wrks > 1)
+    # Forked before there are any connections; the workers only parse.
+    pool  = multiprocessing.Pool(wrks) if wrks > 1 else None
+    if options.get('MIGRATE_TYPES'):
+      with connections.shared(options).connection() as postgres:
+        for ddl in rmessages.ThouSchema(postgres).retype(rmessages.MSG_ASSOC.values()):
+          print ddl
+    if options.get('DAEMON'):
+      listen(args, options, pool)
+    else:
+      conns, postgres, wque = open_queue(options)
+      sts   = stats.Stats()
+      once  = True
+      while once:
+        once  = single_handle(TREATED, postgres, args, options, pool, wque, sts) and options.get('REPEAT', not once)
+      wque.release()
+      conns.closeall()
+    if pool:
+      pool.close()
+      pool.join()
+    close_cache()
   if options.get('BACKGROUND'):
     chp = os.fork()
     if chp:
@@ -35,134 +55,327 @@ def handle_messages(args, options):
   else:
     gun()
 
-def single_handle(tbn, pgc, args, options):
+def open_queue(options):
+  'Gets the connections of a transfer from the pool, returning the pool, the connection to write over, and the queue of rows to transfer.'
+  conns     = connections.shared(options)
+  postgres  = conns.get()
+  # A pipeline reads over a connection of its own, if POOL_SIZE leaves one to spare.
+  reader    = conns.get() if int(options.get('PIPELINE', 0)) and conns.size > 1 else None
+  return (conns, postgres, work_queue(postgres, options, TREATED[0], reader))
+
+def listen(args, options, pool = None):
+  '''Transfers messages as they come in, for as long as it runs (the DAEMON mode).
+It LISTENs on CHANNEL (which `listener.install` makes `messagelog_message` notify; INSTALL_TRIGGER runs it first), and on every notification transfers all that is new, MICRO_BATCH rows (500 by default) at a time. Notifications that come in meanwhile are taken together, after; with LINGER (in seconds), it waits that much longer for more, before it starts.
+It looks for new rows every IDLE seconds (60 by default) all the same, and whenever it connects (again, if it lost the database), it first catches up on what came in while it was not listening. What the work queue holds (the leases, with LEASES) is let go of after every drain, and renewed as it waits.
+A batch that fails in the database, or whose lease was taken over, is rolled back, and the transfer goes on at once from the last commit, with a work queue made afresh.
+So that a message that cannot be stored (a number too large for its column, say) does not hold up all the others for good, a batch that fails RETRIES times over (3 by default) is halved, again and again; a batch of one that fails too is set aside (see `set_aside`), and the transfer goes on with whole micro-batches.
+The time from a notification being seen to the commit of the rows it was for is `notify_latency_seconds`, in the stats.'''
+  chan  = options.get('CHANNEL', listener.CHANNEL)
+  idle  = float(options.get('IDLE', 60))
+  lngr  = float(options.get('LINGER', 0))
+  opts  = dict(options, QUIET = '1', NUMBER = options.get('MICRO_BATCH', 500))
+  micro = int(opts['NUMBER'])
+  tries = int(options.get('RETRIES', 3))
+  sts   = stats.Stats()
+  wait  = 1
+  while True:
+    conns = connections.shared(options)
+    lstn  = None
+    try:
+      # Listening before catching up, so that nothing comes in between.
+      lstn  = listener.Listener(connections.settings(options), chan)
+      conns, postgres, wque = open_queue(options)
+      if options.get('INSTALL_TRIGGER'):
+        listener.install(postgres, chan)
+      print 'Listening on %s.' % (chan,)
+      got   = 0
+      # The size of the batches, and the failures in a row at that size.
+      size  = micro
+      fails = 0
+      while True:
+        try:
+          if not size:
+            set_aside(postgres, opts, wque, sts)
+            size  = micro
+          if drain(args, dict(opts, NUMBER = size), postgres, pool, wque, sts) and got:
+            sts.since('notify_latency_seconds', lstn.seen)
+          wque.release()
+          size, fails = micro, 0
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+          raise
+        except (workqueue.LeaseLost, psycopg2.DatabaseError), e:
+          print 'Batch given up (%s); going on from the last commit.' % (str(e).strip(),)
+          sts.count('batch_failures')
+          wque  = restart(postgres, opts, wque)
+          if isinstance(e, workqueue.LeaseLost):
+            continue
+          # If not even the setting aside went through, it is tried again when there is more to do.
+          if size:
+            fails = fails + 1
+            if fails >= tries:
+              size, fails = size // 2, 0
+            continue
+        wait  = 1
+        got   = lstn.wait(idle, lngr)
+        if got:
+          sts.count('notifications', got)
+        else:
+          lstn.ping()
+          wque.renew()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError), e:
+      print 'Lost the database (%s); connecting again in %ds.' % (str(e).strip(), wait)
+      sts.count('reconnects')
+      if lstn:
+        lstn.close()
+      conns.closeall()
+      times.sleep(wait)
+      wait  = min(wait * 2, 60)
+
+def restart(pgc, options, wque):
+  '''Rolls back what was under way on `pgc`, lets go of what the work queue `wque` held (what was not taken over), and returns a new queue, which picks up from the last commit.'''
+  pgc.rollback()
+  rdr = wque.reader if wque.reader is not pgc else None
+  if rdr:
+    rdr.rollback()
+  wque.release()
+  return work_queue(pgc, options, TREATED[0], rdr)
+
+def set_aside(pgc, options, wque, sts):
+  '''Stores the first of the rows to transfer from `wque` as a failed transfer ('not_stored'), without its parsed values, and checkpoints it; for the row that no batch it is in can be stored.
+Returns its id, or None if there was nothing to set aside.'''
+  reps  = wque.fetch(1)
+  if not reps: return None
+  fid, txt  = reps[0][0], reps[0][4]
+  print 'Message #%d set aside: it could not be stored.' % (fid,)
+  wrtr  = bulkwriter.BulkWriter(pgc, sts = sts)
+  store_failures(wrtr, ['not_stored'], txt, fid)
+  store_treatment(wrtr, fid, False)
+  finish_batch(wrtr, wque, fid, sts, options)
+  pgc.commit()
+  sts.count('messages', outcome = 'set_aside')
+  return fid
+
+def drain(args, options, pgc, pool, wque, sts):
+  'Transfers all the untreated rows there are, NUMBER at a time; returns whether there were any.'
+  ans = False
+  while single_handle(TREATED, pgc, args, options, pool, wque, sts):
+    ans = True
+  return ans
+
+def single_handle(tbn, pgc, args, options, pool = None, wque = None, sts = None):
   cpt   = int(options.get('NUMBER', 5000))
   force = options.get('FORCE', False)
-  qry   = orm.ORM.query(tbn[0], {}, migrations  = tbn[1])
-  dsiz  = qry.count()
-  seen  = set()
-  upds  = []
   deler = options.get('DELETE', False)
-  if deler:
-    upds  = []
-  for ix in range(dsiz):
-    row   = qry[ix]
-    if not row: break
-    ixnum = row['oldid']
-    act   = 'Loaded'
-    if deler:
-      try:
-        # it  = Report.objects.get(id = ixnum)
-        # it.delete()
-        pass
-      except Exception, e:
-        pass
-      upds.append(str(row['indexcol']))
-    act   = 'Deleted'
-    sys.stdout.flush()
-    seen.add(str(ixnum))
-  # print 'Updating deletion status ...',
-  # ThouReport.store(tbn,
-  #   {'indexcol': upds, 'transferred': True}
-  # )
-  # print '... done.'
-  curz  = pgc.cursor()
-  # reps  = Report.objects.exclude(id__in = seen).order_by('-date')
-  gat   = options.get('TYPE', None)
-  nar   = 'TRUE'
-  if not seen:
-    seen.add('0')
-  if gat:
-    # reps  = reps.filter(type_id = gat)
-    nar = "LOWER(SUBSTR(text, 0, 4)) = '%s'" % (gat.lower(), )
-  query = '''SELECT id, contact_id, connection_id, date, text FROM messagelog_message WHERE (%s) AND (id NOT IN (%s)) ORDER BY RANDOM() LIMIT %d''' % (nar, ', '.join(seen), cpt)
-  curz.execute(query)
-  # tot   = reps.count()
-  print query
-  tot   = curz.rowcount
-  if not tot: return False
-  cpt   = min(tot, cpt)
-  # reps  = reps[0:cpt]
-  reps  = curz.fetchmany(cpt)
-  print ('Already got %d of %d, now moving %d ...' % (len(seen), tot, cpt))
+  wque  = wque or work_queue(pgc, options, tbn[0])
+  sts   = sts or stats.Stats()
+  # With PIPELINE, fetching, parsing and writing are threads of their own, with queues of (up to) that many chunks between them.
+  depth = int(options.get('PIPELINE', 0))
+  strm  = options.get('STREAM', False) or depth
+  typd  = options.get('TYPED', False)
+  chk   = int(options.get('CHUNK', 250))
+  sttm  = default_timer()
+  reps  = wque.stream(cpt, int(options.get('ITERSIZE', 2000))) if strm else wque.fetch(cpt)
+  chks  = chunked(reps, chk)
+  if strm:
+    # The rows come as the chunks are cut, so that is what is timed.
+    chks  = sts.timed('fetch_seconds', chks)
+  else:
+    sts.since('fetch_seconds', sttm)
+    cpt = len(reps)
+  if depth:
+    chks  = pipeline.ahead(chks, depth, sts, 'fetch')
+  frst  = next(chks, None)
+  if not frst: return False
+  talk  = not options.get('QUIET')
+  if talk:
+    print ('From #%d, now moving up to %d ...' % (frst[0][0], cpt))
   # convr = BasicConverter({'transferred':True} if deler and force else {})
-  cpt   = float(cpt)
   pos   = 0
-  maxw  = 80
   stbs  = set()
-  sttm  = times.time()
-  for rep in reps:
-    fps = float(pos + 1)
-    pct = (fps / cpt) * 100.0
-    gap = ' ' * max(0, (int(((fps / cpt) * float(maxw))) - len('100.0%') - len(str(pos + 1)) - 2))
-    ctm = times.time() - sttm
-    dlt = datetime.timedelta(seconds = int(ctm * (cpt / fps)))
-    eta = datetime.datetime.now() + dlt
-    pad = ((' %s ' % (str(dlt), )) + (' ' * maxw))
+  quiet = options.get('BACKGROUND') or options.get('QUIET')
+  prg   = stats.Progress(cpt, None if quiet else sys.stdout, float(options.get('PROGRESS_EVERY', 1.0)))
+  rsts  = parse_chunks(itertools.chain([frst], chks), pool, typed = typd, sts = sts)
+  if depth:
+    # Handed over a chunk at a time, since a queue costs more than a row is worth.
+    rsts  = itertools.chain.from_iterable(pipeline.ahead(chunked(rsts, chk), depth, sts, 'parse'))
+  wrtr  = bulkwriter.BulkWriter(pgc, int(options.get('BATCH', 1000)), types = row_types() if typd else None, sts = sts)
+  for got in rsts:
+    prg.tick(pos)
     # osp = OldStyleReport(rep, curz, convr)
-    if not options.get('BACKGROUND'):
-      rsp = ('%d %s%3.1f%%%s' % (pos + 1, gap, pct, pad))
-      sys.stdout.write('\r' + rsp[0:maxw])
-      sys.stdout.flush()
     # gat             = osp.convert()
     # suc, thid, tbn  = gat
     # if not any([suc, thid]):
     #   raise Exception, str(gat)
-    succ  = False
-    try:
-      ans   = rmessages.ThouMessage.parse(rep[4], rep[3])
-      mname = str(ans.__class__).split('.')[-1].lower()
-      succ  = True
-      store_components(mname, ans, rep[0])
+    fid, txt, succ, mname, princ, auxil, errs = got
+    if succ:
+      store_components(wrtr, mname, princ, auxil, fid, txt)
       stbs.add(mname)
-      # print "\033[34m\033[47m", ('Success with #%d %s:\n%s' % (rep[0], rep[4], str(ans.entries))), "\033[0m\n"
-    except rmessages.ThouMsgError, e:
-      store_failures(e, rep[4], rep[0])
-      # print "\033[34m\033[47m", str([x.subname() for x in e.message.fields]), "\n\033[7m", ('Errors with #%d %s:\n%s' % (rep[0], rep[4], str(e.errors), )), "\033[0m\n"
-    store_treatment(rep[0], succ)
+      sts.count('messages', outcome = 'success')
+    else:
+      store_failures(wrtr, errs, txt, fid)
+      sts.count('messages', outcome = 'failure')
+    store_treatment(wrtr, fid, succ)
     if deler and force:
       # rep.delete()
       pass
     pos = pos + 1
-    pgc.commit()
-  print 'Done converting ...'
-  print 'List of secondary tables:'
-  for tbn in stbs:
-    print tbn
-  curz.close()
+    if wrtr.full():
+      finish_batch(wrtr, wque, fid, sts, options)
+  finish_batch(wrtr, wque, fid, sts, options)
+  prg.done(pos)
+  if PARSER is not rmessages.ThouMessage and hasattr(PARSER, 'sync'):
+    PARSER.sync()
+  if talk:
+    print 'Done converting ...'
+    print 'Time spent:', sts.summary(STAGES)
+    if PARSER is not rmessages.ThouMessage:
+      print 'Parse cache:', cache_summary(sts)
+    print 'List of secondary tables:'
+    for tbn in stbs:
+      print tbn
   pgc.commit()
   return True
 
-def store_components(mname, msg, fid):
-  princ = {'oldid': fid, 'message': msg}
-  auxil = {}
-  for k in msg.entries.keys():
-    chose = msg.entries[k]
-    if chose.several_fields:
-      subk  = '%s_%s' % (mname, k)
-      naux  = auxil.get(subk, [])
-      naux.extend(chose.data())
-      auxil[subk] = naux
-    else:
-      princ[k]  = chose.data()
-  ix  = orm.ORM.store(mname, princ)
-  for k in auxil.keys():
-    val = auxil[k]
-    for v in val:
-      orm.ORM.store(k, {'principal': ix, 'value': v})
-
-def store_failures(err, msg, fid):
+def finish_batch(wrtr, wque, fid, sts, options):
+  '''Checkpoints the work queue at `fid`, writes out (and commits) the batch, and dumps the stats.
+Stats go to STATS_FILE, if there is one: a line of JSON per batch, or (STATS_FORMAT prometheus) a Prometheus text file, rewritten every batch.'''
+  sttm  = default_timer()
+  wque.checkpoint(fid)
+  sts.since('checkpoint_seconds', sttm)
+  wrtr.flush()
+  sts.count('batches')
+  if options.get('STATS_FILE'):
+    stats.dump(sts, options['STATS_FILE'], options.get('STATS_FORMAT', 'json'), run = wque.run, batch = wque.batch, lastid = fid)
+
+def work_queue(conn, options, treated, reader = None):
+  '''The queue of rows to transfer that `options` ask for; every batch looks back over LOOKBACK ids (1000 by default) under the mark (or under each lease) for rows committed late.
+With LEASES, it is shared with every other process that runs with LEASES (on whatever host), each working through ranges of LEASE_SPAN ids (10000 by default) that it holds for LEASE_SECONDS (600 by default) at a time; see `workqueue.LeaseQueue`.'''
+  scope = options.get('TYPE', None)
+  run   = options.get('RUN', None)
+  if not options.get('LEASES'):
+    return workqueue.WorkQueue(conn, scope, treated, run, reader, int(options.get('LOOKBACK', 1000)))
+  if int(options.get('PIPELINE', 0)) and not reader:
+    raise Exception('LEASES with PIPELINE needs a connection to read over, of its own: set POOL_SIZE to 2 or more.')
+  return workqueue.LeaseQueue(conn, scope, treated, run, reader, int(options.get('LEASE_SPAN', 10000)), int(options.get('LEASE_SECONDS', 600)), int(options.get('LOOKBACK', 1000)))
+
+def use_cache(options, pooled = False):
+  '''Puts a parse cache in front of the parser, if `options` ask for one: `CACHE` entries in memory, kept on disk in `CACHE_FILE` too.
+Each worker of a pool keeps a cache of its own, which is why they cannot share the file.'''
+  global PARSER
+  size  = int(options.get('CACHE', 0))
+  path  = options.get('CACHE_FILE')
+  if path and pooled:
+    print 'CACHE_FILE is not used with WORKERS; each worker caches in memory only.'
+    path  = None
+  if path:
+    PARSER  = cache.ThouDiskCache(path, size or 10000)
+  elif size:
+    PARSER  = cache.ThouCache(size)
+
+def close_cache():
+  'Closes the parse cache that `use_cache` put in, writing out its file if it has one, and goes back to parsing without it.'
+  global PARSER
+  if hasattr(PARSER, 'close'):
+    PARSER.close()
+  PARSER  = rmessages.ThouMessage
+
+def chunked(reps, chk):
+  'Cuts the rows of the iterable `reps` into lists of `chk` rows, lazily.'
+  reps  = iter(reps)
+  while True:
+    got = list(itertools.islice(reps, chk))
+    if not got: return
+    yield got
+
+def parse_chunks(chks, pool = None, wind = 8, typed = False, sts = None):
+  '''Parses the chunks of rows `chks` (see `parse_rows`), yielding the results in order.
+With a `pool`, no more than `wind` chunks are out with the workers at any time, so that a stream of rows is not read ahead without end.
+The time spent on each message goes in `sts`, if given; the workers send theirs back with their chunks.'''
+  if not pool:
+    for chk in chks:
+      for got in parse_rows(chk, typed, sts):
+        yield got
+    return
+  pend  = collections.deque()
+  def done():
+    got = pend.popleft().get()
+    if not sts: return got
+    sts.merge(got[1])
+    return got[0]
+  for chk in chks:
+    pend.append(pool.apply_async(parse_timed if sts else parse_rows, (chk, typed)))
+    if len(pend) >= wind:
+      for got in done():
+        yield got
+  while pend:
+    for got in done():
+      yield got
+
+def parse_timed(reps, typed = False):
+  'Same as `parse_rows`, but returns the `stats.Stats` of the chunk with its results.'
+  sts = stats.Stats()
+  return (parse_rows(reps, typed, sts), sts)
+
+def parse_rows(reps, typed = False, sts = None):
+  '''Parses a chunk of fetched `messagelog_message` rows, returning a list of compact, picklable tuples:
+(id, text, success, table name, principal values, auxiliary values, error codes).
+If `typed`, the values are as the columns of `row_types` take them (see `ThouField.column_value`); otherwise they are left for TEXT columns.
+This is what the `WORKERS` pool runs; it touches no database.
+The time that each message took goes in `sts` (if given), by message class.'''
+  ans   = []
+  cach  = sts and PARSER is not rmessages.ThouMessage
+  if cach:
+    was = (PARSER.hits, PARSER.stored, PARSER.misses)
+  rsts  = PARSER.parse_many((rep[4], rep[3]) for rep in reps)
+  if sts:
+    rsts  = sts.timed('parse_seconds', rsts, 'klass', lambda rst: rst.klass.__name__)
+  for rep, rst in itertools.izip(reps, rsts):
+    if not rst.success:
+      errs  = [fc[0] if type(fc) == type(('', None)) else fc for fc in rst.errors]
+      ans.append((rep[0], rep[4], False, None, None, None, errs))
+      continue
+    lay   = rst.klass.layout()
+    princ = dict([(k, rst.value(k)) for k in lay.principal])
+    auxil = dict([(tbl, list(rst.value(k))) for k, tbl in lay.auxiliary])
+    if typed:
+      flds  = lay.entries
+      princ = dict([(k, flds[k].column_value(v)) for k, v in princ.iteritems()])
+      auxil = dict([(tbl, [flds[k].column_value(v) for v in auxil[tbl]]) for k, tbl in lay.auxiliary])
+    ans.append((rep[0], rep[4], True, lay.name, princ, auxil, []))
+  if cach:
+    for how, bfr, aft in zip(['hit', 'stored', 'miss'], was, (PARSER.hits, PARSER.stored, PARSER.misses)):
+      sts.count('parse_cache', aft - bfr, outcome = how)
+  return ans
+
+def cache_summary(sts):
+  'One line of the lookups of the parse cache, as `parse_rows` counted them in `sts`; the counts of pool workers come back with their stats.'
+  cnts  = dict([(how, sts.counter('parse_cache', outcome = how)) for how in ['hit', 'stored', 'miss']])
+  tot   = sum(cnts.values())
+  return '%d hits, %d stored, %d misses (%.1f%% found)' % (cnts['hit'], cnts['stored'], cnts['miss'], (100.0 * (cnts['hit'] + cnts['stored']) / tot) if tot else 0.0)
+
+def row_types():
+  'Returns the SQL types of the columns that the transfers write, by table and then by column, for every message class.'
+  ans = {}
+  for klass in rmessages.MSG_ASSOC.values():
+    for tbl, typs in klass.layout().rowtypes.items():
+      ans.setdefault(tbl, {}).update(typs)
+  return ans
+
+def store_components(wrtr, mname, princ, auxil, fid, msg):
+  wrtr.principal(mname, dict(princ, oldid = fid, message = msg), auxil)
+
+def store_failures(wrtr, errs, msg, fid):
   pos = 0
-  for fc in err.errors:
-    fc  = fc[0] if type(fc) == type(('', None)) else fc
-    orm.ORM.store('failed_transfers', {'oldid': fid, 'message': msg, 'failcode': fc, 'failpos': pos})
+  for fc in errs:
+    wrtr.store('failed_transfers', {'oldid': fid, 'message': msg, 'failcode': fc, 'failpos': pos})
     pos = pos + 1
 
-def store_treatment(fid, stt):
-  orm.ORM.store('treated_messages', {'oldid': fid, 'success': stt})
+def store_treatment(wrtr, fid, stt):
+  wrtr.store('treated_messages', {'oldid': fid, 'success': stt})
 
 def imain(args):
   handle_messages(args, os.environ)
   return 0
 
-sys.exit(imain(sys.argv))
+if __name__ == '__main__':
+  sys.exit(imain(sys.argv))
@@ -0,0 +1,290 @@
+# encoding: UTF-8
+import os
+import socket
+import uuid
+
+CHECKPOINTS = 'transfer_checkpoints'
+LEASES      = 'transfer_leases'
+
+class WorkQueue:
+  '''Hands out the untreated rows of `messagelog_message` a batch at a time, in ascending order of id.
+Every batch is a range scan from the high-water mark of the run, so a batch costs the same however much has been treated already; the anti-join against the treated table only ever probes the rows of the batch.
+Untreated rows under the mark of a new run (left over by the old random-order runs) are swept up first, once.
+Ids are drawn when a row is inserted, not when it is committed, so a row can turn up under the mark after the mark has passed it; every batch looks back over the `lookback` ids under the mark for such rows, before it goes on from the mark. A run that starts again (or a queue made afresh) sweeps those under the mark it starts from, once.
+Where each run (named by `run`, or else by its `scope`: the message type being transferred, or 'all') has got to is kept in `transfer_checkpoints`, by `checkpoint`. Since that is committed with the rows it covers, a restarted run picks up exactly where the last commit left it, without looking at what is done.
+The rows can be read over a connection of their own (`reader`), so that reading them does not wait on the writes; checkpoints always go on `conn`, with the rows.'''
+  def __init__(self, conn, scope = None, treated = 'treated_messages', run = None, reader = None, lookback = 1000):
+    self.conn     = conn
+    self.reader   = reader or conn
+    self.treated  = treated
+    self.scope    = (scope or 'all').lower()
+    self.run      = run or self.scope
+    self.cond     = "LOWER(SUBSTR(text, 0, 4)) = %s" if scope else 'TRUE'
+    self.args     = (scope.lower(),) if scope else ()
+    self.lookback = lookback
+    self.ceiling, self.sweep, self.swept, self.batch = self.load()
+    if self.swept:
+      self.sweep, self.swept  = max(self.ceiling - lookback, 0), False
+    self.lastid   = self.ceiling
+    self.mark     = self.ceiling
+
+  def load(self):
+    'Makes sure that the tables the queue relies on are there, and returns the checkpoint of the run: (mark, sweep position, whether swept, batch number).'
+    curz  = self.conn.cursor()
+    self.prepare(curz)
+    curz.execute('''CREATE TABLE IF NOT EXISTS %s (run TEXT PRIMARY KEY, scope TEXT NOT NULL, lastid INTEGER NOT NULL, sweep INTEGER NOT NULL DEFAULT 0,
+swept BOOLEAN NOT NULL DEFAULT FALSE, batch INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW());''' % (CHECKPOINTS,))
+    curz.execute('SELECT lastid, sweep, swept, batch FROM %s WHERE run = %%s' % (CHECKPOINTS,), (self.run,))
+    got   = curz.fetchone()
+    if not got:
+      curz.execute('SELECT COALESCE(MAX(oldid), 0) FROM %s' % (self.treated,))
+      got = (curz.fetchone()[0], 0, False, 0)
+      curz.execute('INSERT INTO %s (run, scope, lastid) VALUES (%%s, %%s, %%s)' % (CHECKPOINTS,), (self.run, self.scope, got[0]))
+    curz.close()
+    self.conn.commit()
+    return got
+
+  def prepare(self, curz):
+    'Makes the treated table, if it is not there.'
+    curz.execute('CREATE TABLE IF NOT EXISTS %s (indexcol SERIAL NOT NULL, oldid INTEGER, success BOOLEAN);' % (self.treated,))
+    curz.execute('CREATE INDEX IF NOT EXISTS %s_oldid ON %s (oldid);' % (self.treated, self.treated))
+
+  def query(self, upper):
+    return '''SELECT id, contact_id, connection_id, date, text FROM messagelog_message m WHERE (%s) AND m.id > %%s%s AND NOT EXISTS (SELECT 1 FROM %s t WHERE t.oldid = m.id) ORDER BY m.id LIMIT %%s''' % (self.cond, ' AND m.id <= %s' if upper else '', self.treated)
+
+  def fetch(self, cpt):
+    'Returns a list of up to `cpt` untreated rows (id, contact_id, connection_id, date, text), stragglers under the mark first.'
+    return list(self.rows(cpt, self.reader.cursor))
+
+  def stream(self, cpt, itersize = 2000):
+    '''Yields the same rows as `fetch` would return, but reads them off named (server-side) cursors, `itersize` rows at a time.
+So memory stays flat however large `cpt` is. The cursors are held over commits, so the rows can be stored on the same connection as they come.'''
+    def named():
+      curz          = self.reader.cursor('workqueue', withhold = True)
+      curz.itersize = itersize
+      return curz
+    return self.rows(cpt, named)
+
+  def rows(self, cpt, cursor):
+    'Yields up to `cpt` untreated rows, read through the cursors made by `cursor`.'
+    if self.sweep >= self.ceiling:
+      self.swept  = True
+    if not self.swept:
+      got = 0
+      for rep in self.scan(cursor(), True, (self.sweep, self.ceiling, cpt)):
+        self.sweep  = rep[0]
+        got         = got + 1
+        yield rep
+      if got < cpt:
+        self.swept  = True
+      cpt = cpt - got
+    lowr  = max(self.lastid - self.lookback, self.ceiling)
+    if cpt > 0 and lowr < self.lastid:
+      # Late commits under the mark; the mark itself stays where it is.
+      for rep in self.scan(cursor(), True, (lowr, self.lastid, cpt)):
+        cpt = cpt - 1
+        yield rep
+    if cpt > 0:
+      for rep in self.scan(cursor(), False, (self.lastid, cpt)):
+        self.lastid = rep[0]
+        yield rep
+
+  def scan(self, curz, upper, args):
+    try:
+      curz.execute(self.query(upper), self.args + args)
+      for rep in curz:
+        yield rep
+    finally:
+      curz.close()
+      if self.reader is not self.conn:
+        # Nothing is written there; this only lets go of the snapshot, so that the next scan sees what has been committed since.
+        self.reader.rollback()
+
+  def checkpoint(self, fid):
+    '''Records that every row handed out, up to and including the one with id `fid`, is done.
+It goes in the open transaction, to be committed with (and only with) the rows stored for those messages.'''
+    if fid <= self.ceiling:
+      mark, sweep, swept  = self.ceiling, fid, False
+    else:
+      mark, sweep, swept  = max(fid, self.mark), self.ceiling, True
+      self.mark           = mark
+    self.batch  = self.batch + 1
+    curz  = self.conn.cursor()
+    curz.execute('''UPDATE %s SET lastid = %%s, sweep = %%s, swept = %%s, batch = %%s, updated_at = NOW() WHERE run = %%s''' % (CHECKPOINTS,),
+      (mark, sweep, swept, self.batch, self.run))
+    curz.close()
+
+  def release(self):
+    'Lets go of what the queue holds for the run, before it is dropped; there is nothing to let go of here.'
+    pass
+
+  def renew(self):
+    'Keeps what the queue holds for the run while it waits; nothing, here.'
+    pass
+
+class LeaseLost(Exception):
+  pass
+
+class LeaseQueue(WorkQueue):
+  '''A `WorkQueue` that any number of processes, on any number of hosts, can share without any message being treated twice.
+Each process takes a lease on a range of `span` ids at a time, from `transfer_leases`, and hands out the untreated rows in it; the leases are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so no two processes ever hold the same range. New ranges are carved out as messages come in, by whichever process runs out of them first.
+A lease lasts `seconds`. Every `checkpoint` records how far the held leases have got, renews them, and lets go of the ones that are worked through, all in the transaction that stores their rows. If a process dies, or stalls past its lease, another takes the range over from its last commit; the one that stalled finds out at its next checkpoint (`LeaseLost`), before any of its batch is committed.
+Rows can commit late under where a lease has got to, as under the mark of a `WorkQueue`; so every scan of a lease looks back over the `lookback` ids under it, and a range is only done once it is more than `lookback` ids under the greatest id (see `over`). Until then, a range that is worked through is let go of, to be claimed, and looked back over, again.
+Leases are claimed on the `reader` connection, and committed there at once; so with a pipeline (where rows are read while others are written), that must be a connection of its own.'''
+  def __init__(self, conn, scope = None, treated = 'treated_messages', run = None, reader = None, span = 10000, seconds = 600, lookback = 1000):
+    self.span     = span
+    self.seconds  = seconds
+    self.owner    = '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    # The leases held, in the order they were claimed (which is the order their rows are handed out in).
+    self.held     = []
+    # The ranges let go of as soon as they were claimed, with nothing in them; not claimed again until the next batch.
+    self.skip     = []
+    WorkQueue.__init__(self, conn, scope, treated, run, reader, lookback)
+
+  def load(self):
+    'Makes sure that the tables the queue relies on are there.'
+    curz  = self.conn.cursor()
+    self.prepare(curz)
+    curz.execute('''CREATE TABLE IF NOT EXISTS %s (run TEXT NOT NULL, lo INTEGER NOT NULL, hi INTEGER NOT NULL, lastid INTEGER NOT NULL,
+done BOOLEAN NOT NULL DEFAULT FALSE, owner TEXT, expires TIMESTAMP WITHOUT TIME ZONE, PRIMARY KEY (run, lo));''' % (LEASES,))
+    curz.close()
+    self.conn.commit()
+    return (0, 0, True, 0)
+
+  def claim(self):
+    '''Takes a lease on the first range of the run that is neither done nor held, returning it (as a dict), or None if there is none.
+Its `top` is the greatest id of `messagelog_message` when it was claimed; a range that is worked through is done only if it does not go past that, since new messages may yet come into it.'''
+    curz  = self.reader.cursor()
+    try:
+      curz.execute('''UPDATE %s l SET owner = %%s, expires = NOW() + %%s * INTERVAL '1 second' WHERE l.run = %%s AND l.lo = (SELECT lo FROM %s
+WHERE run = %%s AND NOT done AND (owner IS NULL OR expires < NOW()) AND NOT (lo = ANY(%%s)) ORDER BY lo LIMIT 1 FOR UPDATE SKIP LOCKED)
+RETURNING l.lo, l.hi, l.lastid, (SELECT COALESCE(MAX(id), 0) FROM messagelog_message)''' % (LEASES, LEASES), (self.owner, self.seconds, self.run, self.run, self.skip))
+      got = curz.fetchone()
+    finally:
+      curz.close()
+    self.reader.commit()
+    if not got: return None
+    lse = {'lo': got[0], 'hi': got[1], 'from': got[2], 'top': got[3], 'last': None, 'drained': False}
+    for old in self.held:
+      if old['lo'] == lse['lo']:
+        # One of ours that ran out, claimed again: it goes on from where it had got to, which may be past its last checkpoint.
+        old['top'], old['drained']  = lse['top'], False
+        return old
+    self.held.append(lse)
+    return lse
+
+  def carve(self):
+    'Adds the ranges of ids that messages have come in since the last were carved out (for every process, at once).'
+    curz  = self.reader.cursor()
+    try:
+      curz.execute('''INSERT INTO %s (run, lo, hi, lastid) SELECT %%s, g, g + %%s, g FROM generate_series(
+(SELECT COALESCE(MAX(hi), 0) FROM %s WHERE run = %%s), (SELECT COALESCE(MAX(id), 0) FROM messagelog_message) - 1, %%s) g ON CONFLICT DO NOTHING''' % (LEASES, LEASES),
+        (self.run, self.span, self.run, self.span))
+    finally:
+      curz.close()
+    self.reader.commit()
+
+  def lease(self):
+    'The held lease that is not yet worked through, or a new one (carving out new ranges if need be), or None if there is nothing left to claim.'
+    for lse in self.held:
+      if not lse['drained']: return lse
+    got = self.claim()
+    if got is None:
+      self.carve()
+      got = self.claim()
+    return got
+
+  def rows(self, cpt, cursor):
+    '''Yields up to `cpt` untreated rows from the leased ranges, claiming more as they are worked through.
+Each lease is scanned from `lookback` ids under where it has got to, for rows committed late; where it has got to only ever goes up.
+A lease that has nothing in it is let go of at once (see `drop`), rather than held until the next checkpoint.'''
+    self.skip = []
+    while cpt > 0:
+      lse = self.lease()
+      if lse is None: return
+      got = 0
+      for rep in self.scan(cursor(), True, (max(lse['from'] - self.lookback, lse['lo']), lse['hi'], cpt)):
+        lse['from'] = max(lse['from'], rep[0])
+        lse['last'] = rep[0]
+        got         = got + 1
+        yield rep
+      if got < cpt:
+        lse['drained']  = True
+        if lse['last'] is None:
+          self.drop(lse)
+      cpt = cpt - got
+
+  def drop(self, lse):
+    '''Lets go of the lease `lse`, worked through with nothing handed out: it is moved up to all that there was of it when it was claimed (and done, if it is `over`), and committed on the reader, as `claim` is.
+So the range, at the tail most likely, is free for others (or for the next batch) to look at again as messages come in.'''
+    curz  = self.reader.cursor()
+    try:
+      self.finish(curz, lse)
+    except LeaseLost:
+      # Taken over already; there was nothing of it to lose.
+      pass
+    finally:
+      curz.close()
+    self.reader.commit()
+    self.held.remove(lse)
+    self.skip.append(lse['lo'])
+
+  def checkpoint(self, fid):
+    '''Records that every row handed out, up to and including the one with id `fid`, is done: the leases handed out before it are let go of (done, if they are), that of `fid` is moved up to it, and all are renewed.
+It goes in the open transaction, to be committed with (and only with) the rows stored for those messages.'''
+    held  = list(self.held)
+    cur   = [ix for ix, lse in enumerate(held) if lse['lo'] < fid <= lse['hi']]
+    cur   = cur[0] if cur else -1
+    curz  = self.conn.cursor()
+    try:
+      for ix, lse in enumerate(held):
+        if ix < cur or (ix == cur and lse['drained'] and lse['last'] == fid):
+          # Everything of it that there was, when it was claimed, is done.
+          self.finish(curz, lse)
+          self.held.remove(lse)
+        elif ix == cur:
+          self.update(curz, lse, "lastid = GREATEST(lastid, %s), expires = NOW() + %s * INTERVAL '1 second'", (fid, self.seconds))
+        else:
+          # Rows of it may be out already, but none are stored yet.
+          self.update(curz, lse, "expires = NOW() + %s * INTERVAL '1 second'", (self.seconds,))
+    finally:
+      curz.close()
+    self.batch  = self.batch + 1
+
+  def over(self, lse):
+    'Whether no more rows can come into the range of `lse`: all of it was more than `lookback` ids under the greatest id when it was claimed.'
+    return lse['hi'] + self.lookback <= lse['top']
+
+  def finish(self, curz, lse):
+    'Lets go of `lse`, worked through: moved up to all that there was of it when it was claimed, and done if it is `over`.'
+    self.update(curz, lse, 'lastid = GREATEST(lastid, %s), done = %s, owner = NULL, expires = NULL', (min(lse['hi'], lse['top']), self.over(lse)))
+
+  def update(self, curz, lse, sets, args):
+    curz.execute('UPDATE %s SET %s WHERE run = %%s AND lo = %%s AND owner = %%s' % (LEASES, sets), args + (self.run, lse['lo'], self.owner))
+    if curz.rowcount != 1:
+      raise LeaseLost('The lease on ids %d to %d of run %s was taken over; this batch is not committed.' % (lse['lo'] + 1, lse['hi'], self.run))
+
+  def release(self):
+    'Lets go of the leases still held, where they have got to, so that others need not wait for them to run out.'
+    curz  = self.conn.cursor()
+    try:
+      for lse in self.held:
+        try:
+          self.update(curz, lse, 'owner = NULL, expires = NULL', ())
+        except LeaseLost:
+          # Taken over already; there is nothing of it to let go of.
+          pass
+    finally:
+      curz.close()
+    self.held = []
+    self.conn.commit()
+
+  def renew(self):
+    'Renews the leases still held, where they have got to, and commits that; for a process that waits for messages between batches.'
+    curz  = self.conn.cursor()
+    try:
+      for lse in self.held:
+        self.update(curz, lse, "expires = NOW() + %s * INTERVAL '1 second'", (self.seconds,))
+    finally:
+      curz.close()
+    self.conn.commit()